@@ -0,0 +1,412 @@
+#! /usr/bin/env python
+#
+# Copyright (C) 2009-2014 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Offline benchmark for the afc_statistics task's sync and save.
+
+The wiki replica is replaced by an in-memory SQLite database holding the
+MediaWiki tables the task queries, filled by a synthetic generator, and the
+API by a fake site that serves revision content from the same data. Our own
+statistics database must be a real (local) MySQL server, since the task relies
+on MySQL-specific SQL; its tables are recreated from tasks/schema/ for every
+run, so point this at a scratch database.
+
+For each size, we time an initial sync that tracks every pending submission,
+an incremental sync with no changes, one after a batch of edits, a full
+reconciliation sync, a save, and a rebuild of the emptied database. Example:
+
+    python benchmarks/afc_statistics.py --sizes 1000 5000 20000 \
+        --user bench --database afc_statistics_bench
+"""
+
+import argparse
+import importlib.util
+import logging
+import random
+import re
+import sqlite3
+import types
+from datetime import datetime, timedelta
+from os import path
+from threading import Lock
+from time import time
+
+import pymysql
+import pymysql.cursors
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+TASK_PATH = path.join(ROOT, "tasks", "afc_statistics.py")
+SCHEMA_PATH = path.join(ROOT, "tasks", "schema", "afc_statistics.sql")
+
+PENDING_CAT = "Pending AfC submissions"
+DATETIME = re.compile(r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d$")
+NAMESPACES = {0: "", 2: "User", 5: "Wikipedia talk", 118: "Draft"}
+REPLICA_SCHEMA = """
+CREATE TABLE page (
+    page_id INTEGER PRIMARY KEY, page_namespace INTEGER, page_title BLOB,
+    page_latest INTEGER
+);
+CREATE TABLE revision (
+    rev_id INTEGER PRIMARY KEY, rev_page INTEGER, rev_timestamp TEXT,
+    rev_actor INTEGER, rev_comment_id INTEGER
+);
+CREATE INDEX rev_page_timestamp ON revision (rev_page, rev_timestamp);
+CREATE VIEW revision_userindex AS SELECT * FROM revision;
+CREATE TABLE actor (actor_id INTEGER PRIMARY KEY, actor_name BLOB);
+CREATE TABLE comment (comment_id INTEGER PRIMARY KEY, comment_text TEXT);
+CREATE TABLE categorylinks (cl_from INTEGER, cl_to BLOB, cl_timestamp TEXT);
+CREATE INDEX cl_timestamp ON categorylinks (cl_to, cl_timestamp);
+CREATE TABLE recentchanges (rc_cur_id INTEGER, rc_timestamp BLOB);
+CREATE INDEX rc_timestamp ON recentchanges (rc_timestamp);
+CREATE TABLE logging_logindex (
+    log_page INTEGER, log_type TEXT, log_timestamp TEXT, log_actor INTEGER,
+    log_namespace INTEGER, log_comment_id INTEGER
+);
+CREATE INDEX log_page_time ON logging_logindex (log_page, log_timestamp);
+"""
+
+
+def _qmark_execute(method):
+    """Wrap a pymysql cursor method to accept qmark-style placeholders.
+
+    The task writes its queries with "?" placeholders, like earwigbot's own
+    SQL helpers, while pymysql only understands the "%s" style.
+    """
+
+    def wrapper(self, query, args=None):
+        if args is not None:
+            query = query.replace("?", "%s")
+        return method(self, query, args)
+
+    return wrapper
+
+
+pymysql.cursors.Cursor.execute = _qmark_execute(pymysql.cursors.Cursor.execute)
+pymysql.cursors.Cursor.executemany = _qmark_execute(pymysql.cursors.Cursor.executemany)
+
+
+class Replica:
+    """A synthetic wiki replica with a number of AfC submissions."""
+
+    def __init__(self, size, seed):
+        self.rand = random.Random(seed)
+        self.db = sqlite3.connect(":memory:", check_same_thread=False)
+        self.db.executescript(REPLICA_SCHEMA)
+        self.content = {}
+        self.pending = []
+        self.now = datetime.utcnow()
+        self._next_revid = 1
+        self._users = [f"Editor {i}" for i in range(1, 501)]
+        self._generate(size)
+
+    @staticmethod
+    def stamp(date):
+        return date.strftime("%Y%m%d%H%M%S")
+
+    def _generate(self, size):
+        self.db.executemany(
+            "INSERT INTO actor VALUES (?, ?)",
+            [(i, user.encode("utf8")) for i, user in enumerate(self._users, 1)],
+        )
+        self.db.execute("INSERT INTO comment VALUES (1, 'Edited draft')")
+        for pageid in range(1, size + 1):
+            ns = self.rand.choice([118] * 8 + [2, 5])
+            title = f"Synthetic submission {pageid}"
+            if ns == 5:
+                title = "Articles for creation/" + title
+            self.db.execute(
+                "INSERT INTO page VALUES (?, ?, ?, 0)",
+                (pageid, ns, title.replace(" ", "_").encode("utf8")),
+            )
+            date = self.now - timedelta(days=self.rand.uniform(1, 6))
+            for _ in range(self.rand.randint(1, 6)):
+                date += timedelta(minutes=self.rand.randint(1, 120))
+                self.edit(pageid, date, "draft")
+            date += timedelta(minutes=self.rand.randint(1, 60))
+            self.edit(pageid, date, "pending")
+            self.db.execute(
+                "INSERT INTO categorylinks VALUES (?, ?, ?)",
+                (
+                    pageid,
+                    PENDING_CAT.replace(" ", "_").encode("utf8"),
+                    date.strftime("%Y-%m-%d %H:%M:%S"),
+                ),
+            )
+            self.pending.append(pageid)
+        self.db.commit()
+
+    def _make_content(self, status, user, date):
+        body = " ".join(["Lorem ipsum dolor sit amet."] * self.rand.randint(10, 200))
+        if self.rand.random() < 0.5:
+            body += "<ref>{{cite web|url=http://example.com}}</ref>"
+        elif self.rand.random() < 0.5:
+            body += " [http://example.org A source]"
+        if status == "draft":
+            return "{{AfC submission|t||ts=" + self.stamp(date) + "}}\n" + body
+        if status == "declined":
+            template = "{{AfC submission|d|nn|u=" + user + "|ts=" + self.stamp(date)
+            template += "|decliner=" + user + "|declinets=" + self.stamp(date) + "}}"
+            return template + "\n" + body
+        template = "{{AfC submission|||u=" + user + "|ts=" + self.stamp(date)
+        return template + "|ns=118}}\n" + body
+
+    def edit(self, pageid, date, status):
+        """Add a revision to a page, setting its submission status."""
+        revid = self._next_revid
+        self._next_revid += 1
+        actor = self.rand.randint(1, len(self._users))
+        user = self._users[actor - 1]
+        self.content[revid] = self._make_content(status, user, date)
+        self.db.execute(
+            "INSERT INTO revision VALUES (?, ?, ?, ?, 1)",
+            (revid, pageid, self.stamp(date), actor),
+        )
+        self.db.execute(
+            "INSERT INTO recentchanges VALUES (?, ?)",
+            (pageid, self.stamp(date).encode("utf8")),
+        )
+        self.db.execute(
+            "UPDATE page SET page_latest = ? WHERE page_id = ?", (revid, pageid)
+        )
+        return revid
+
+    def churn(self, fraction):
+        """Edit a fraction of the pending submissions, declining half of them."""
+        self.now += timedelta(minutes=5)
+        count = max(1, int(len(self.pending) * fraction))
+        for i, pageid in enumerate(self.rand.sample(self.pending, count)):
+            self.edit(pageid, self.now, "declined" if i % 2 else "pending")
+        self.db.commit()
+        return count
+
+
+class FakePage:
+    def __init__(self, site, title):
+        self.site = site
+        self.title = title
+        prefix = title.split(":", 1)[0] if ":" in title else ""
+        names = {name: ns for ns, name in NAMESPACES.items()}
+        self.namespace = names.get(prefix, 0)
+
+    def edit(self, text, summary, **kwargs):
+        self.site.edits += 1
+
+
+class FakeUser:
+    blockinfo = False
+
+
+class FakeConnection:
+    """A stand-in for a worker's own replica connection, sharing the Replica."""
+
+    def __init__(self, site):
+        self.site = site
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def autocommit(self, value):
+        pass
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=()):
+        self.rows = list(self.site.sql_query(query, params))
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeSite:
+    """A stand-in for earwigbot's Site backed by a Replica."""
+
+    domain = "en.wikipedia.org"
+
+    def __init__(self, replica):
+        self.replica = replica
+        self.edits = 0
+        self._sql_lock = Lock()
+
+    def sql_query(self, query, params=()):
+        # Binary MediaWiki columns are stored as BLOBs, so compare them as such
+        # (except for real timestamp columns, like cl_timestamp):
+        params = [
+            p.encode("utf8") if isinstance(p, str) and not DATETIME.match(p) else p
+            for p in params
+        ]
+        with self._sql_lock:
+            yield from self.replica.db.execute(query, params).fetchall()
+
+    def api_query(self, **kwargs):
+        if kwargs.get("list") == "blocks":
+            return {"query": {"blocks": []}}
+        if "revids" in kwargs:
+            revids = [int(revid) for revid in str(kwargs["revids"]).split("|")]
+            revisions = [
+                {"revid": revid, "slots": {"main": {"*": self.replica.content[revid]}}}
+                for revid in revids
+                if revid in self.replica.content
+            ]
+            return {"query": {"pages": {"1": {"revisions": revisions}}}}
+        if "titles" in kwargs:
+            pages = {
+                str(-i): {"title": title, "missing": ""}
+                for i, title in enumerate(kwargs["titles"].split("|"), 1)
+            }
+            return {"curtimestamp": "", "query": {"pages": pages}}
+        return {"query": {}}
+
+    def _sql_connect(self):
+        return FakeConnection(self)
+
+    def get_replag(self):
+        return 0
+
+    def namespace_id_to_name(self, ns):
+        return NAMESPACES.get(ns, "")
+
+    def get_page(self, title):
+        return FakePage(self, title)
+
+    def get_user(self, name):
+        return FakeUser()
+
+
+def load_task(site, conn_data, workers):
+    """Load the afc_statistics task with a fake bot around the given site."""
+    spec = importlib.util.spec_from_file_location("afc_statistics", TASK_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    config = types.SimpleNamespace(
+        tasks={"afc_statistics": {"sql": dict(conn_data), "workers": workers}},
+        wiki={"summary": "$2"},
+    )
+    bot = types.SimpleNamespace(
+        config=config,
+        wiki=types.SimpleNamespace(get_site=lambda: site),
+        tasks=types.SimpleNamespace(logger=logging.getLogger("benchmark")),
+    )
+    return module.AfCStatistics(bot)
+
+
+def reset_database(conn_data):
+    """Recreate our statistics tables from the schema script."""
+    with open(SCHEMA_PATH) as fp:
+        lines = [line for line in fp if not line.startswith("--")]
+    statements = [stmt.strip() for stmt in "".join(lines).split(";")]
+
+    conn = pymysql.connect(**conn_data)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SET SESSION sql_mode = ''")
+            for statement in statements:
+                if statement and not statement.startswith("CREATE DATABASE"):
+                    cursor.execute(statement)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def run_size(size, args, conn_data):
+    """Run and time every scenario for one number of submissions."""
+    start = time()
+    replica = Replica(size, args.seed)
+    print(f"\n{size} submissions (replica built in {time() - start:.1f}s)")
+    reset_database(conn_data)
+    site = FakeSite(replica)
+    task = load_task(site, conn_data, args.workers)
+
+    scenarios = [
+        ("initial", "sync", {}, None),
+        ("idle", "sync", {}, None),
+        ("churn", "sync", {}, lambda: replica.churn(args.churn)),
+        ("full", "sync", {"full": True}, None),
+        ("save", "save", {"fromIRC": True}, None),
+        ("rebuild", "rebuild", {}, lambda: reset_database(conn_data)),
+    ]
+    try:
+        for name, action, kwargs, prepare in scenarios:
+            if prepare:
+                prepare()
+            start = time()
+            task.run(action=action, **kwargs)
+            elapsed = time() - start
+            stats = task.stats_history[-1] if task.stats_history else None
+            print(f"  {name:<8} {elapsed:8.2f}s")
+            if args.verbose and stats:
+                print(f"           {stats.summary()}")
+    finally:
+        task.unload()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 5000, 20000],
+        help="numbers of submissions to benchmark",
+    )
+    parser.add_argument("--workers", type=int, default=1, help="sync workers")
+    parser.add_argument(
+        "--churn",
+        type=float,
+        default=0.05,
+        help="fraction of submissions edited before the churn sync",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="generator seed")
+    parser.add_argument("--host", default="localhost", help="MySQL host")
+    parser.add_argument("--user", help="MySQL user")
+    parser.add_argument("--password", help="MySQL password")
+    parser.add_argument(
+        "--database",
+        default="afc_statistics_bench",
+        help="scratch MySQL database (its tables will be dropped!)",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="show per-phase stats"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    conn_data = {"host": args.host, "db": args.database}
+    if args.user:
+        conn_data["user"] = args.user
+    if args.password:
+        conn_data["passwd"] = args.password
+
+    for size in args.sizes:
+        run_size(size, args, conn_data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Copyright (C) 2009-2014 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from earwigbot.commands import Command
+
+
+class AfCSyncStats(Command):
+    """Get timings and counters for recent AfC statistics syncs and saves."""
+
+    name = "syncstats"
+    commands = ["syncstats", "afcstats"]
+
+    MAX_ENTRIES = 5
+
+    def process(self, data):
+        try:
+            statistics = self.bot.tasks.get("afc_statistics")
+        except KeyError:
+            e = "Cannot run command: requires afc_statistics task (from earwigbot_plugins)"
+            self.logger.error(e)
+            msg = "command requires afc_statistics task (from earwigbot_plugins)"
+            self.reply(data, msg)
+            return
+
+        action = None
+        count = 1
+        for arg in data.args:
+            if arg.isdigit():
+                count = min(max(int(arg), 1), self.MAX_ENTRIES)
+            elif arg in ("sync", "save", "rebuild"):
+                action = arg
+            else:
+                msg = (
+                    "Unknown argument: \x0303{0}\x0f. Valid args are "
+                    + "'sync', 'save', 'rebuild', or a number of entries."
+                )
+                self.reply(data, msg.format(arg))
+                return
+
+        history = [
+            stats
+            for stats in list(statistics.stats_history)
+            if not action or stats.action == action
+        ]
+        if not history:
+            self.reply(data, f"No {action or 'sync'}s recorded yet.")
+            return
+
+        for stats in history[-count:]:
+            started = stats.started.strftime("%H:%M:%S")
+            self.reply(data, f"[{started} UTC] {stats.summary()}")
@@ -18,12 +18,18 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import json
 import re
-from collections import OrderedDict
-from datetime import datetime
+import sqlite3
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from hashlib import sha256
 from os.path import expanduser
-from threading import Lock
-from time import sleep
+from threading import Lock, local
+from time import sleep, time
 
 import mwparserfromhell
 import pymysql
@@ -44,6 +50,124 @@ templates it uses, documented in [[Template:AfC statistics/doc]]. -->
 """
 
 _PER_CHART_LIMIT = 1000
+_REPLICA_BATCH_SIZE = 500
+_API_REVISION_LIMIT = 50
+_HISTORY_PROBES = 4
+_API_BLOCK_LIMIT = 50
+
+# Stale page refresh scheduling (see AfCStatistics._update_stale()): at least
+# _MIN_STALE_PAGES are refreshed per sync, chosen from the highest-priority
+# _STALE_CANDIDATES. Priority is seconds since the last update, plus a bonus
+# for pending submissions and for each second of replag at the last update.
+_MIN_STALE_PAGES = 10
+_STALE_CANDIDATES = 500
+_STALE_PENDING_BONUS = 24 * 60 * 60
+_STALE_REPLAG_WEIGHT = 60
+_STALE_REPLAG_MIN = 60
+
+# Changed and untracked pages are processed this many at a time, or one per
+# worker if there are more workers, with the sync's deadline checked in between
+# (see AfCStatistics._process_chunks()):
+_SYNC_CHUNK_SIZE = 10
+
+# How long to remember who accepted a page (see AfCStatistics.get_accepted()):
+_ACCEPT_CACHE_TTL = 60 * 60
+
+# Pages are tracked in batches of this size during a rebuild, no larger than
+# the parsed revision cache so each is parsed once (see AfCStatistics.rebuild()).
+# Accepted submissions are found by page moves with comments matching
+# _ACCEPT_MOVE_COMMENT, like those made by the AFCH script.
+_REBUILD_BATCH_SIZE = 200
+_ACCEPT_MOVE_COMMENT = "%Articles for creation%"
+
+# Changes to our database's schema, as (name, statements), applied in order to
+# existing databases by AfCStatistics._migrate() before any action touches
+# them. New databases created from tasks/schema/afc_statistics.sql already have
+# all of them. chart_hash and syncstate predate the runner, so databases may
+# already have them from being altered by hand (see _MIGRATION_APPLIED_ERRORS).
+_SCHEMA_MIGRATIONS = [
+    (
+        "chart_hash",
+        ["ALTER TABLE chart ADD COLUMN chart_hash binary(32) DEFAULT NULL"],
+    ),
+    (
+        "syncstate",
+        [
+            """CREATE TABLE syncstate (
+                state_key varchar(64) NOT NULL,
+                state_value varchar(255) DEFAULT NULL,
+                PRIMARY KEY (state_key)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci"""
+        ],
+    ),
+    (
+        "time_indexes",
+        [
+            "ALTER TABLE updatelog ADD INDEX update_time (update_time)",
+            "ALTER TABLE row ADD INDEX row_chart (row_chart)",
+            "ALTER TABLE page ADD INDEX page_special_time (page_special_time)",
+        ],
+    ),
+    (
+        "update_replag",
+        [
+            """ALTER TABLE updatelog ADD COLUMN
+               update_replag int(10) unsigned NOT NULL DEFAULT 0"""
+        ],
+    ),
+    (
+        "creation",
+        [
+            """CREATE TABLE creation (
+                create_id int(10) unsigned NOT NULL,
+                create_user varchar(255) DEFAULT NULL,
+                create_time timestamp NOT NULL DEFAULT '0000-00-00 00:00:00',
+                create_oldid int(10) unsigned NOT NULL,
+                PRIMARY KEY (create_id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci"""
+        ],
+    ),
+    (
+        "submission",
+        [
+            """CREATE TABLE submission (
+                submission_id int(10) unsigned NOT NULL,
+                submission_hash binary(32) NOT NULL,
+                submission_record mediumtext NOT NULL,
+                submission_chart tinyint(3) unsigned NOT NULL,
+                submission_special_user varchar(255) DEFAULT NULL,
+                submission_special_time timestamp NULL DEFAULT NULL,
+                submission_special_oldid int(10) unsigned DEFAULT NULL,
+                PRIMARY KEY (submission_id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci"""
+        ],
+    ),
+    (
+        "replag_index",
+        ["ALTER TABLE updatelog ADD INDEX update_replag (update_replag)"],
+    ),
+]
+
+# MySQL errors meaning a migration statement was already applied by hand:
+# table exists, duplicate column name, duplicate key name.
+_MIGRATION_APPLIED_ERRORS = (1050, 1060, 1061)
+
+
+def _chunks(items, size):
+    """Yield successive lists of at most 'size' items from 'items'."""
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def _normalize_username(username):
+    """Return a username in MediaWiki's canonical form, as list=blocks gives.
+
+    Underscores become spaces, runs of whitespace are collapsed, and the first
+    letter is capitalized.
+    """
+    username = " ".join(username.replace("_", " ").split())
+    return username[:1].upper() + username[1:]
 
 
 class AfCStatistics(Task):
@@ -69,12 +193,19 @@ class AfCStatistics(Task):
     def setup(self):
         self.cfg = cfg = self.config.tasks.get(self.name, {})
         self.site = self.bot.wiki.get_site()
-        self.revision_cache = {}
 
         # Set some wiki-related attributes:
         self.pageroot = cfg.get("page", "Template:AfC statistics")
         self.pending_cat = cfg.get("pending", "Pending AfC submissions")
+        self.reviewing_cat = cfg.get(
+            "reviewing", "Pending AfC submissions being reviewed now"
+        )
+        self.declined_cat = cfg.get("declined", "Declined AfC submissions")
         self.ignore_list = cfg.get("ignoreList", [])
+        self.history_search = cfg.get("historySearch", "linear")
+        self.incremental = cfg.get("incremental", True)
+        self.reconcile_interval = cfg.get("reconcileInterval", 60 * 60)
+        self.sync_budget = cfg.get("syncBudget", 2 * 60)
         default_summary = (
             "Updating statistics for [[WP:WPAFC|WikiProject Articles for creation]]."
         )
@@ -86,50 +217,220 @@ class AfCStatistics(Task):
         self.tl_row = templates.get("row", "#invoke:AfC|row")
         self.tl_footer = templates.get("footer", "AfC statistics/footer")
 
+        # Chart row formats, keyed by (has special info, has notes):
+        row = "{{" + self.tl_row.replace("%", "%%") + "|s=%s|t=%s|z=%s|"
+        special = "sr=%s|sd=%s|si=%s|"
+        modify = "mr=%s|md=%s|mi=%s"
+        self.row_formats = {
+            (False, False): row + modify + "}}",
+            (True, False): row + special + modify + "}}",
+            (False, True): row + modify + "|n=1%s}}",
+            (True, True): row + special + modify + "|n=1%s}}",
+        }
+
         # Connection data for our SQL database:
         kwargs = cfg.get("sql", {})
         kwargs["read_default_file"] = expanduser("~/.my.cnf")
         self.conn_data = kwargs
-        self.db_access_lock = Lock()
+        self.migration_lock = Lock()
+
+        # Syncs and saves exclude only themselves; a save reads a consistent
+        # snapshot on its own connection, so it needn't wait for a sync:
+        self.sync_lock = Lock()
+        self.save_lock = Lock()
+
+        # Pages are processed concurrently during syncs by this many workers,
+        # each with its own replica connection from the pool (see
+        # self._sql_query()); writes go to self.buffer:
+        self.workers = cfg.get("workers", 1)
+        self.replica_pool = _ConnectionPool(self._connect_replica, self.workers)
+        self.worker_state = local()
+        self.migrated = False
+
+        # Revision content cache, optionally persisted to disk between runs,
+        # and a smaller cache of parsed revisions (see self._analyze()):
+        cache = cfg.get("revisionCache", {})
+        self.revision_cache = _RevisionCache(
+            cache.get("size", 1000), cache.get("path"), cache.get("diskSize", 50000)
+        )
+        self.analysis_cache = _LRUCache(200)
+
+        # Stored rows, last edits, remembered creations, and stored submission
+        # records of pages about to be processed (see self._prefetch_pages()):
+        self.page_info = {}
+        self.modify_info = {}
+        self.creation_info = {}
+        self.submission_info = {}
+
+        # Block status of submitters, as (is blocked, time checked), reused for
+        # self.block_cache_ttl seconds (see self._is_blocked()):
+        self.block_cache = _LRUCache(5000)
+        self.block_cache_ttl = cfg.get("blockCacheTTL", 5 * 60)
+
+        # Acceptance info of pages, as (result, time checked):
+        self.accept_cache = _LRUCache(1000)
+
+        # Timings and counters of the current sync or rebuild (saves keep their
+        # own), and of recent runs (see self._finish_stats() and the
+        # afc_syncstats command):
+        self.stats = _SyncStats(None)
+        self.stats_history = deque(maxlen=cfg.get("statsHistory", 20))
 
     def run(self, **kwargs):
         """Entry point for a task event.
 
         Depending on the kwargs passed, we will either synchronize our local
-        statistics database with the site (self.sync()) or save it to the wiki
-        (self.save()). We will additionally create an SQL connection with our
-        local database.
+        statistics database with the site (self.sync()), rebuild it from
+        scratch (self.rebuild()), or save it to the wiki (self.save()). We will
+        additionally create an SQL connection with our local database.
+
+        A save and a sync can run at the same time, since they use separate
+        connections and the save only reads from a snapshot of the database.
         """
         action = kwargs.get("action")
-        if not self.db_access_lock.acquire(False):  # Non-blocking
+        lock = self.save_lock if action == "save" else self.sync_lock
+        if not lock.acquire(False):  # Non-blocking
             if action == "sync":
                 self.logger.info("A sync is already ongoing; aborting")
                 return
             self.logger.info("Waiting for database access lock")
-            self.db_access_lock.acquire()
+            lock.acquire()
 
         try:
             self.site = self.bot.wiki.get_site()
-            self.conn = pymysql.connect(**self.conn_data)
-            self.revision_cache = {}
+            conn = pymysql.connect(**self.conn_data)
             try:
-                if action == "save":
-                    self.save(kwargs)
-                elif action == "sync":
-                    self.sync(kwargs)
+                self._migrate(conn)
+                stats = _SyncStats(action)
+                try:
+                    if action == "save":
+                        self.save(kwargs, conn, stats)
+                    elif action == "sync":
+                        self.conn, self.stats = conn, stats
+                        self.sync(kwargs)
+                    elif action == "rebuild":
+                        self.conn, self.stats = conn, stats
+                        self.rebuild(kwargs)
+                finally:
+                    self._finish_stats(stats)
+                    if action != "save":
+                        self.stats = _SyncStats(None)
             finally:
-                self.conn.close()
+                conn.close()
+                if action != "save":
+                    self.replica_pool.close()
+                    self.revision_cache.flush()
         finally:
-            self.db_access_lock.release()
+            lock.release()
+
+    def unload(self):
+        """Hook called immediately before the task is unloaded."""
+        self.revision_cache.close()
+
+    def _finish_stats(self, stats):
+        """Log the stats of a finished sync or save, and remember them."""
+        if stats.action not in ("save", "sync", "rebuild"):
+            return
+        stats.finish()
+        self.stats_history.append(stats)
+        self.logger.info(stats.summary())
+
+    def _sql_query(self, query, args=()):
+        """Run a query on the replica, recording it in self.stats.
+
+        The full result is returned as a list. Worker threads use their own
+        replica connection (see self._process_pages()), since the site's is
+        shared behind a lock; otherwise, the site's connection is used.
+        """
+        start = time()
+        conn = getattr(self.worker_state, "replica", None)
+        if conn is None:
+            result = list(self.site.sql_query(query, args))
+        else:
+            with conn.cursor() as cursor:
+                cursor.execute(query, args)
+                result = list(cursor.fetchall())
+        self.stats.add("sql", time() - start)
+        return result
+
+    def _connect_replica(self):
+        """Open a new connection to the site's replica, for a worker thread."""
+        conn = self.site._sql_connect()
+        conn.autocommit(True)
+        return conn
+
+    def _api_query(self, stats=None, **kwargs):
+        """Make an API query, recording it in 'stats' or self.stats."""
+        start = time()
+        try:
+            return self.site.api_query(**kwargs)
+        finally:
+            (stats or self.stats).add("api", time() - start)
+
+    def _migrate(self, conn):
+        """Bring our database's schema up to date.
+
+        Migrations in _SCHEMA_MIGRATIONS that aren't recorded in the migration
+        table are applied and recorded. This only happens once per process.
+        """
+        with self.migration_lock:
+            if not self.migrated:
+                self._apply_migrations(conn)
+                self.migrated = True
+
+    def _apply_migrations(self, conn):
+        """Apply and record the migrations missing from our database.
+
+        The transaction is always ended, even if nothing was applied, so the
+        caller can set up its own (like save()'s consistent snapshot).
+        """
+        query1 = """CREATE TABLE IF NOT EXISTS migration (
+                        migration_name varchar(64) NOT NULL,
+                        migration_time timestamp NOT NULL
+                            DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (migration_name)
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8
+                    COLLATE=utf8_unicode_ci"""
+        query2 = "SELECT migration_name FROM migration"
+        query3 = "INSERT INTO migration (migration_name) VALUES (?)"
+
+        with conn.cursor() as cursor:
+            cursor.execute(query1)
+            cursor.execute(query2)
+            applied = {name for (name,) in cursor.fetchall()}
+            for name, statements in _SCHEMA_MIGRATIONS:
+                if name in applied:
+                    continue
+                self.logger.info(f"Applying schema migration {name}")
+                for statement in statements:
+                    try:
+                        cursor.execute(statement)
+                    except pymysql.MySQLError as exc:
+                        if exc.args[0] not in _MIGRATION_APPLIED_ERRORS:
+                            raise
+                        msg = "Schema migration {0} was already applied: {1}"
+                        self.logger.debug(msg.format(name, exc.args[1]))
+                cursor.execute(query3, (name,))
+                conn.commit()
+        conn.commit()
 
     #################### CHART BUILDING AND SAVING METHODS ####################
 
-    def save(self, kwargs):
+    def save(self, kwargs, conn, stats):
         """Save our local statistics to the wiki.
 
         After checking for emergency shutoff, the statistics chart is compiled,
         and then saved to subpages of self.pageroot using self.summary iff it
         has changed since last save.
+
+        We store a hash of each chart in our database when it is saved, and
+        don't bother loading the page again if the chart's hash is the same,
+        unless given the kwarg "force". The pages for the remaining charts are
+        loaded together with one API query (self._get_chart_pages()).
+
+        The charts are compiled from a consistent snapshot of our database on
+        'conn', so a sync committing in the meantime can't mix old and new
+        rows; the snapshot is released before the slower wiki edits.
         """
         self.logger.info("Saving chart")
         if kwargs.get("fromIRC"):
@@ -139,16 +440,93 @@ class AfCStatistics(Task):
                 return
             summary = self.summary
 
-        statistics = self._compile_charts()
+        with stats.phase("compile"):
+            with conn.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+            try:
+                statistics = self._compile_charts(conn)
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT chart_name, chart_hash FROM chart")
+                    hashes = dict(cursor.fetchall())
+            finally:
+                conn.rollback()  # Read-only; just end the snapshot
+
+        changed = OrderedDict()
         for name, chart in statistics.items():
-            self._save_page(name, chart, summary)
+            digest = sha256(chart.encode("utf8")).digest()
+            if digest == hashes.get(name) and not kwargs.get("force"):
+                self.logger.info(f"Chart for {name} unchanged since last save")
+                continue
+            changed[name] = (chart, digest)
+        if not changed:
+            return
+
+        with stats.phase("load"):
+            pages = self._get_chart_pages(list(changed), stats)
+        saved = {}
+        with stats.phase("edit"):
+            try:
+                for name, (chart, digest) in changed.items():
+                    if self._save_page(name, chart, summary, *pages[name]):
+                        saved[name] = digest
+                    stats.add_pages(1)
+            finally:
+                self._save_chart_hashes(conn, saved)
+
+    def _save_chart_hashes(self, conn, hashes):
+        """Store the hashes of the last saved versions of some charts.
+
+        'hashes' maps chart names to digests. They are committed right away,
+        since our connection isn't in autocommit mode.
+        """
+        if not hashes:
+            return
+        query = "UPDATE chart SET chart_hash = ? WHERE chart_name = ?"
+        with conn.cursor() as cursor:
+            cursor.executemany(query, [(dig, name) for name, dig in hashes.items()])
+        conn.commit()
+
+    def _get_chart_pages(self, names, stats):
+        """Load the current text of many chart pages with one API query.
+
+        Returns a dict mapping each chart name to a 3-tuple of (page text,
+        timestamp of its latest revision, time of the query), the latter two
+        being used to detect edit conflicts. The text and revision timestamp
+        are None if the page doesn't exist.
+        """
+        titles = {f"{self.pageroot}/{name}": name for name in names}
+        res = self._api_query(
+            stats,
+            action="query",
+            prop="revisions",
+            rvprop="content|timestamp",
+            rvslots="main",
+            titles="|".join(titles),
+            curtimestamp=1,
+        )
+        start = res.get("curtimestamp")
+        for norm in res["query"].get("normalized", []):
+            if norm["from"] in titles:
+                titles[norm["to"]] = titles.pop(norm["from"])
+
+        pages = {name: (None, None, start) for name in names}
+        for data in res["query"]["pages"].values():
+            if "revisions" not in data or data["title"] not in titles:
+                continue
+            revision = data["revisions"][0]
+            text = revision["slots"]["main"]["*"]
+            pages[titles[data["title"]]] = (text, revision["timestamp"], start)
+        return pages
+
+    def _save_page(self, name, chart, summary, text, basetimestamp, starttimestamp):
+        """Save a statistics chart to a single page.
 
-    def _save_page(self, name, chart, summary):
-        """Save a statistics chart to a single page."""
+        'text' is the page's current content, or None if it doesn't exist.
+        Returns whether the page is now up to date.
+        """
         page = self.site.get_page(f"{self.pageroot}/{name}")
-        try:
-            text = page.get()
-        except exceptions.PageNotFoundError:
+        if text is None:
             text = _DEFAULT_PAGE_TEXT % {"pageroot": self.pageroot}
 
         newtext = re.sub(
@@ -159,48 +537,70 @@ class AfCStatistics(Task):
         )
         if newtext == text:
             self.logger.info(f"Chart for {name} unchanged; not saving")
-            return
+            return True
 
         newtext = re.sub(
             "<!-- sig begin -->(.*?)<!-- sig end -->",
             "<!-- sig begin -->~~~ at ~~~~~<!-- sig end -->",
             newtext,
         )
-        page.edit(newtext, summary, minor=True, bot=True)
+        try:
+            page.edit(
+                newtext,
+                summary,
+                minor=True,
+                bot=True,
+                basetimestamp=basetimestamp,
+                starttimestamp=starttimestamp,
+                createonly=None if basetimestamp else "true",
+                nocreate="true" if basetimestamp else None,
+            )
+        except exceptions.EditConflictError:
+            msg = f"Edit conflict while saving chart for {name} to [[{page.title}]]"
+            self.logger.warn(msg)
+            return False
         self.logger.info(f"Chart for {name} saved to [[{page.title}]]")
+        return True
 
-    def _compile_charts(self):
+    def _compile_charts(self, conn):
         """Compile and return all statistics information from our local db."""
         stats = OrderedDict()
-        with self.conn.cursor(pymysql.cursors.DictCursor) as cursor:
+        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
             cursor.execute("SELECT * FROM chart")
             for chart in cursor:
                 name = chart["chart_name"]
-                stats[name] = self._compile_chart(chart)
+                stats[name] = self._compile_chart(conn, chart)
         return stats
 
-    def _compile_chart(self, chart_info):
-        """Compile and return a single statistics chart."""
-        chart = self.tl_header + "|" + chart_info["chart_title"]
-        if chart_info["chart_special_title"]:
-            chart += "|" + chart_info["chart_special_title"]
-        chart = "{{" + chart + "}}"
-
-        query = "SELECT * FROM page JOIN row ON page_id = row_id WHERE row_chart = ?"
-        with self.conn.cursor(pymysql.cursors.DictCursor) as cursor:
-            cursor.execute(query, (chart_info["chart_id"],))
-            rows = cursor.fetchall()
-            skipped = max(0, len(rows) - _PER_CHART_LIMIT)
-            rows = rows[:_PER_CHART_LIMIT]
-            for page in rows:
-                chart += "\n" + self._compile_chart_row(page)
+    def _compile_chart(self, conn, chart_info):
+        """Compile and return a single statistics chart.
 
+        At most _PER_CHART_LIMIT rows are included. They are streamed from the
+        database with a server-side cursor and joined together at the end.
+        """
+        header = self.tl_header + "|" + chart_info["chart_title"]
+        if chart_info["chart_special_title"]:
+            header += "|" + chart_info["chart_special_title"]
+        lines = ["{{" + header + "}}"]
+
+        query1 = """SELECT COUNT(*) FROM page JOIN row ON page_id = row_id
+                    WHERE row_chart = ?"""
+        query2 = """SELECT * FROM page JOIN row ON page_id = row_id
+                    WHERE row_chart = ? LIMIT ?"""
+        with conn.cursor() as cursor:
+            cursor.execute(query1, (chart_info["chart_id"],))
+            (total,) = cursor.fetchone()
+        with conn.cursor(pymysql.cursors.SSDictCursor) as cursor:
+            cursor.execute(query2, (chart_info["chart_id"], _PER_CHART_LIMIT))
+            lines.extend(self._compile_chart_row(page) for page in cursor)
+
+        skipped = max(0, total - _PER_CHART_LIMIT)
         footer = "{{" + self.tl_footer
         if skipped:
             footer += f"|skip={skipped}"
         footer += "}}"
-        chart += "\n" + footer + "\n"
-        return chart
+        lines.append(footer)
+        return "\n".join(lines) + "\n"
 
     def _compile_chart_row(self, page):
         """Compile and return a single chart row.
@@ -208,20 +608,25 @@ class AfCStatistics(Task):
         'page' is a dict of page information, taken as a row from the page
         table, where keys are column names and values are their cell contents.
         """
-        row = "{0}|s={page_status}|t={page_title}|z={page_size}|"
-        if page["page_special_oldid"]:
-            row += (
-                "sr={page_special_user}|sd={page_special_time}|si={page_special_oldid}|"
-            )
-        row += "mr={page_modify_user}|md={page_modify_time}|mi={page_modify_oldid}"
-
-        page["page_special_time"] = self._fmt_time(page["page_special_time"])
-        page["page_modify_time"] = self._fmt_time(page["page_modify_time"])
-
-        if page["page_notes"]:
-            row += "|n=1{page_notes}"
-
-        return "{{" + row.format(self.tl_row, **page) + "}}"
+        special = bool(page["page_special_oldid"])
+        notes = bool(page["page_notes"])
+
+        values = [page["page_status"], page["page_title"], page["page_size"]]
+        if special:
+            values += [
+                page["page_special_user"],
+                self._fmt_time(page["page_special_time"]),
+                page["page_special_oldid"],
+            ]
+        values += [
+            page["page_modify_user"],
+            self._fmt_time(page["page_modify_time"]),
+            page["page_modify_oldid"],
+        ]
+        if notes:
+            values.append(page["page_notes"])
+
+        return self.row_formats[special, notes] % tuple(values)
 
     def _fmt_time(self, date):
         """Format a datetime into the standard MediaWiki timestamp format."""
@@ -237,12 +642,29 @@ class AfCStatistics(Task):
         submissions that are not tracked (self._add_untracked()), and removing
         old submissions from the database (self._delete_old()).
 
+        Changes to pages are collected in a write buffer (self.buffer) while
+        the sync runs, and are flushed at the end in a single transaction,
+        together with the removal of old submissions (self._commit_sync()).
+
+        Normally, only pages that appear in the replica's recent changes since
+        the last sync are updated (see self._get_changes()), and only pages
+        added to the pending category since the last sync are considered for
+        tracking (see self._add_untracked()). A full sweep of every tracked
+        page and the whole pending category is done every
+        self.reconcile_interval seconds, or when given the kwarg "full".
+
+        If updating tracked submissions or adding untracked ones uses up the
+        sync's budget of self.sync_budget seconds, it stops early and the next
+        sync resumes where it left off; otherwise, any time left is spent
+        refreshing stale pages (self._update_stale()).
+
         The sync will be canceled if SQL replication lag is greater than 600
         seconds, because this will lead to potential problems and outdated
         data, not to mention putting demand on an already overloaded server.
         Giving sync the kwarg "ignore_replag" will go around this restriction.
         """
         self.logger.info("Starting sync")
+        self._deadline = time() + self.sync_budget
 
         replag = self.site.get_replag()
         self.logger.debug(f"Server replag is {replag}")
@@ -250,92 +672,355 @@ class AfCStatistics(Task):
             msg = "Sync canceled as replag ({0} secs) is greater than ten minutes"
             self.logger.warn(msg.format(replag))
             return
+        self.replag = replag
 
+        self.buffer = _WriteBuffer()
+        self.page_info = {}
+        self.modify_info = {}
+        self.creation_info = {}
+        self.submission_info = {}
         with self.conn.cursor() as cursor:
-            self._update_tracked(cursor)
-            self._add_untracked(cursor)
-            self._update_stale(cursor)
-            self._delete_old(cursor)
+            with self.stats.phase("changes"):
+                changed, mark = self._get_changes(cursor, kwargs)
+            with self.stats.phase("update_tracked"):
+                done, position = self._update_tracked(cursor, changed)
+            with self.stats.phase("add_untracked"):
+                cl_mark = self._add_untracked(cursor, changed is None)
+            with self.stats.phase("update_stale"):
+                self._update_stale(cursor)
+
+            # Only move the high-water mark once every changed page is done:
+            state = {"tracked_cursor": position}
+            if cl_mark:
+                state["cl_timestamp"] = cl_mark
+            if done:
+                state["rc_timestamp"] = mark
+            if done and changed is None:
+                now = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+                state["reconcile_time"] = now
+            self._commit_sync(cursor, state)
 
         self.logger.info("Sync completed")
 
-    def _update_tracked(self, cursor):
+    def _commit_sync(self, cursor, state, reset=False):
+        """Write the results of a sync to our database in one transaction.
+
+        The transaction contains the buffered page changes, the removal of old
+        submissions (self._delete_old()), and the new sync state, given as a
+        dict. If 'reset' is given, every tracked page is removed first
+        (self._clear_pages()). If anything fails, none of it is applied.
+        """
+        self.conn.begin()
+        try:
+            if reset:
+                self._clear_pages(cursor)
+            with self.stats.phase("flush"):
+                count = self.buffer.flush(cursor)
+            with self.stats.phase("delete_old"):
+                self._delete_old(cursor)
+            for key, value in state.items():
+                self._set_state(cursor, key, value)
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        self.logger.debug(f"Flushed changes to {count} pages")
+
+    def rebuild(self, kwargs):
+        """Rebuild our local statistics database from scratch.
+
+        Rather than waiting for syncs to track submissions one at a time,
+        every current submission is found with a few set-based replica
+        queries (self._get_rebuild_pages()). They are tracked in batches of
+        _REBUILD_BATCH_SIZE, with their content loaded in bulk, on the same
+        worker pool as syncs (see self._prefetch_pages() and
+        self._process_pages()).
+
+        Everything we tracked before is replaced in a single transaction, and
+        the sync state is set up as though a full sync had just finished, so
+        the next sync can be incremental. Like a sync, this is canceled if
+        replag is greater than 600 seconds, unless given the kwarg
+        "ignore_replag".
+        """
+        self.logger.info("Starting rebuild")
+        replag = self.site.get_replag()
+        if replag > 600 and not kwargs.get("ignore_replag"):
+            msg = "Rebuild canceled as replag ({0} secs) is greater than ten minutes"
+            self.logger.warn(msg.format(replag))
+            return
+        self.replag = replag
+
+        query1 = "SELECT MAX(rc_timestamp) FROM recentchanges"
+        query2 = "SELECT MAX(cl_timestamp) FROM categorylinks WHERE cl_to = ?"
+        pend_cat = self.pending_cat.replace(" ", "_")
+        rc_mark = self._sql_query(query1)[0][0].decode("utf8")
+        cl_mark = self._sql_query(query2, (pend_cat,))[0][0]
+
+        self.buffer = _WriteBuffer()
+        self.page_info = {}
+        self.modify_info = {}
+        self.creation_info = {}
+        self.submission_info = {}
+        with self.conn.cursor() as cursor:
+            with self.stats.phase("candidates"):
+                submissions = self._get_rebuild_pages()
+            msg = f"Rebuilding with {len(submissions)} submissions"
+            self.logger.debug(msg)
+
+            e = "Error tracking page [[{0}]] (id: {1})"
+            with self.stats.phase("track"):
+                for batch in _chunks(submissions, _REBUILD_BATCH_SIZE):
+                    pages = [(pid, title, latest) for (pid, latest, title) in batch]
+                    self._prefetch_pages(cursor, pages)
+                    self._process_pages(self._track_page, pages, e)
+
+            now = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+            state = {
+                "rc_timestamp": rc_mark,
+                "reconcile_time": now,
+                "tracked_cursor": "",
+            }
+            if cl_mark:
+                state["cl_timestamp"] = str(cl_mark)
+            self._commit_sync(cursor, state, reset=True)
+
+        self.logger.info("Rebuild completed")
+
+    def _get_rebuild_pages(self):
+        """Return every current submission as (pageid, latest, title) tuples.
+
+        These are the members of self.pending_cat and self.reviewing_cat,
+        submissions added to self.declined_cat in the last 36 hours, and pages
+        moved to the article namespace in that time with a comment like
+        _ACCEPT_MOVE_COMMENT. Older declines and acceptances would only be
+        removed again by self._delete_old().
+        """
+        query1 = """SELECT page_id, page_latest, page_title, page_namespace
+                    FROM page
+                    INNER JOIN categorylinks ON page_id = cl_from
+                    WHERE cl_to IN (?, ?)"""
+        query2 = """SELECT page_id, page_latest, page_title, page_namespace
+                    FROM page
+                    INNER JOIN categorylinks ON page_id = cl_from
+                    WHERE cl_to = ? AND cl_timestamp >= ?"""
+        query3 = """SELECT DISTINCT page_id, page_latest, page_title,
+                    page_namespace
+                    FROM logging_logindex
+                    JOIN page ON log_page = page_id
+                    JOIN comment ON log_comment_id = comment_id
+                    WHERE log_type = "move" AND log_namespace IN (?, ?, ?)
+                    AND log_timestamp >= ? AND page_namespace = ?
+                    AND comment_text LIKE ?"""
+
+        pend_cat = self.pending_cat.replace(" ", "_")
+        review_cat = self.reviewing_cat.replace(" ", "_")
+        decline_cat = self.declined_cat.replace(" ", "_")
+        cutoff = datetime.utcnow() - timedelta(hours=36)
+        cl_cutoff = cutoff.strftime("%Y-%m-%d %H:%M:%S")
+        log_cutoff = cutoff.strftime("%Y%m%d%H%M%S")
+        moved_from = (wiki.NS_DRAFT, wiki.NS_USER, wiki.NS_PROJECT_TALK)
+        moves = moved_from + (log_cutoff, wiki.NS_MAIN, _ACCEPT_MOVE_COMMENT)
+
+        results = [
+            self._sql_query(query1, (pend_cat, review_cat)),
+            self._sql_query(query2, (decline_cat, cl_cutoff)),
+            self._sql_query(query3, moves),
+        ]
+
+        pages = OrderedDict()
+        for result in results:
+            for pageid, latest, title, ns in result:
+                title = self._get_title(title, ns)
+                if title in self.ignore_list or ns == wiki.NS_CATEGORY:
+                    continue
+                pages[pageid] = (pageid, latest, title)
+        return list(pages.values())
+
+    def _get_changes(self, cursor, kwargs):
+        """Find which pages have changed since the last sync.
+
+        Returns a 2-tuple of (set of changed page IDs, new high-water mark).
+        The high-water mark is the latest timestamp in the replica's
+        recentchanges table, which we store in our database once the sync
+        finishes.
+
+        The set is None when we need a full sweep instead: if incremental
+        syncing is disabled, if we have no stored mark, if the last full sweep
+        was more than self.reconcile_interval seconds ago, or if the kwarg
+        "full" was given.
+        """
+        query1 = "SELECT MAX(rc_timestamp) FROM recentchanges"
+        query2 = """SELECT DISTINCT rc_cur_id FROM recentchanges
+                    WHERE rc_timestamp >= ? AND rc_cur_id != 0"""
+
+        mark = self._sql_query(query1)[0][0].decode("utf8")
+        since = self._get_state(cursor, "rc_timestamp")
+        reconciled = self._get_state(cursor, "reconcile_time")
+        if not self.incremental or not since or not reconciled or kwargs.get("full"):
+            self.logger.debug("Doing a full sync")
+            return None, mark
+
+        age = datetime.utcnow() - datetime.strptime(reconciled, "%Y%m%d%H%M%S")
+        if age.total_seconds() > self.reconcile_interval:
+            self.logger.debug("Doing a full sync to reconcile changes")
+            return None, mark
+
+        result = self._sql_query(query2, (since,))
+        changed = {pageid for (pageid,) in result}
+        msg = "Doing an incremental sync: {0} pages changed since {1}"
+        self.logger.debug(msg.format(len(changed), since))
+        return changed, mark
+
+    def _update_tracked(self, cursor, changed=None):
         """Update tracked submissions that have been changed since last sync.
 
-        This is done by iterating through every page in our database and
-        comparing our stored latest revision ID with the actual latest revision
-        ID from an SQL query. If they differ, we will update our information
-        about the page (self._update_page()).
+        This is done by iterating through every page in our database (or only
+        those in 'changed', a set of page IDs, if given) and comparing our
+        stored latest revision ID with the actual latest revision ID from an
+        SQL query. The replica is queried in batches of _REPLICA_BATCH_SIZE
+        pages (self._get_latest_batch()) and compared in memory. If they
+        differ, we will update our information about the page
+        (self._update_page()).
 
         If the page does not exist, we will remove it from our database with
         self._untrack_page().
+
+        Pages are visited in order of ID, starting after the last page visited
+        by a previous sync that ran out of time and wrapping around. Changed
+        pages are updated a few at a time (see self._process_chunks()), and if
+        the sync's deadline passes, we stop after the current chunk. Returns a
+        2-tuple of (whether every page was visited, the ID of the last page
+        visited as a string, or "" if done), the latter of which should be
+        stored as the "tracked_cursor" sync state.
         """
         self.logger.debug("Updating tracked submissions")
-        query1 = """SELECT page_id, page_title, page_modify_oldid
-                    FROM page"""
-        query2 = """SELECT page_latest, page_title, page_namespace
-                    FROM page WHERE page_id = ?"""
+        query = """SELECT page_id, page_title, page_modify_oldid
+                   FROM page ORDER BY page_id"""
 
-        cursor.execute(query1)
-        for pageid, title, oldid in cursor.fetchall():
-            result = list(self.site.sql_query(query2, (pageid,)))
-            if not result:
-                self._untrack_page(cursor, pageid)
-                continue
-            real_oldid, real_title, real_ns = result[0]
-            if oldid == real_oldid:
-                continue
+        cursor.execute(query)
+        tracked = cursor.fetchall()
+        if changed is not None:
+            tracked = [row for row in tracked if row[0] in changed]
+        start = int(self._get_state(cursor, "tracked_cursor") or 0)
+        if start:
+            self.logger.debug(f"Resuming from page (id: {start})")
+            after = [row for row in tracked if row[0] > start]
+            tracked = after + [row for row in tracked if row[0] <= start]
+
+        e = "Error updating page [[{0}]] (id: {1})"
+        position = None
+        for batch in _chunks(tracked, _REPLICA_BATCH_SIZE):
+            if position is not None and time() >= self._deadline:
+                break
+
+            latest = self._get_latest_batch([pageid for (pageid, _, _) in batch])
+            pages = []
+            for pageid, title, oldid in batch:
+                if pageid not in latest:
+                    self._untrack_page(pageid)
+                    continue
+                real_oldid, real_title, real_ns = latest[pageid]
+                if oldid == real_oldid:
+                    continue
+
+                msg = "Updating page [[{0}]] (id: {1}) @ {2}"
+                self.logger.debug(msg.format(title, pageid, oldid))
+                msg = "  {0}: oldid: {1} -> {2}"
+                self.logger.debug(msg.format(pageid, oldid, real_oldid))
+                title = self._get_title(real_title, real_ns)
+                pages.append((pageid, title, real_oldid))
+
+            self._prefetch_pages(cursor, pages)
+            method = self._update_page
+            minimum = 1 if position is None else 0
+            count = self._process_chunks(method, pages, e, minimum)
+            if count < len(pages):
+                position = pages[count - 1][0] if count else position
+                break
+            position = batch[-1][0]
+        else:
+            return True, ""
 
-            msg = "Updating page [[{0}]] (id: {1}) @ {2}"
-            self.logger.debug(msg.format(title, pageid, oldid))
-            msg = "  {0}: oldid: {1} -> {2}"
-            self.logger.debug(msg.format(pageid, oldid, real_oldid))
-            real_title = real_title.decode("utf8").replace("_", " ")
-            ns = self.site.namespace_id_to_name(real_ns)
-            if ns:
-                real_title = ":".join((ns, real_title))
-            try:
-                self._update_page(cursor, pageid, real_title)
-            except Exception:
-                e = "Error updating page [[{0}]] (id: {1})"
-                self.logger.exception(e.format(real_title, pageid))
+        msg = "Sync budget spent; stopping after page (id: {0})"
+        self.logger.info(msg.format(position))
+        return False, str(position)
 
-    def _add_untracked(self, cursor):
+    def _add_untracked(self, cursor, full=False):
         """Add pending submissions that are not yet tracked.
 
-        This is done by compiling a list of all currently tracked submissions
-        and iterating through all members of self.pending_cat via SQL. If a
-        page in the pending category is not tracked and is not in
-        self.ignore_list, we will track it with self._track_page().
+        This is done by compiling a set of all currently tracked submissions
+        and iterating through the members of self.pending_cat via SQL. Unless
+        'full' is given (or we have no stored mark), only members added to the
+        category at or after the high-water mark of the last sync are read,
+        using categorylinks' cl_timestamp. If a page in the pending category
+        is not tracked and is not in self.ignore_list, we will track it with
+        self._track_page(), a few pages at a time (see self._process_chunks()).
+
+        Returns the new high-water mark, to be stored once the sync finishes.
+        If the sync's deadline passes first, the old mark is returned, so the
+        next sync reads the same members again and skips those tracked now.
         """
         self.logger.debug("Adding untracked pending submissions")
         query1 = "SELECT page_id FROM page"
-        query2 = """SELECT page_id, page_title, page_namespace
+        query2 = "SELECT MAX(cl_timestamp) FROM categorylinks WHERE cl_to = ?"
+        query3 = """SELECT page_id, page_latest, page_title, page_namespace
                     FROM page
                     INNER JOIN categorylinks ON page_id = cl_from
                     WHERE cl_to = ?"""
+        query4 = query3 + " AND cl_timestamp >= ?"
 
         cursor.execute(query1)
-        tracked = [pid for (pid,) in cursor.fetchall()]
+        tracked = {pid for (pid,) in cursor.fetchall()}
         pend_cat = self.pending_cat.replace(" ", "_")
+        mark = self._sql_query(query2, (pend_cat,))[0][0]
+        since = None if full else self._get_state(cursor, "cl_timestamp")
+        if since is None:
+            result = self._sql_query(query3, (pend_cat,))
+        else:
+            result = self._sql_query(query4, (pend_cat, since))
 
-        for pageid, title, ns in self.site.sql_query(query2, (pend_cat,)):
+        untracked = []
+        for pageid, latest, title, ns in result:
             if pageid in tracked:
                 continue
 
-            title = title.decode("utf8").replace("_", " ")
-            ns_name = self.site.namespace_id_to_name(ns)
-            if ns_name:
-                title = ":".join((ns_name, title))
+            title = self._get_title(title, ns)
             if title in self.ignore_list or ns == wiki.NS_CATEGORY:
                 continue
             msg = f"Tracking page [[{title}]] (id: {pageid})"
             self.logger.debug(msg)
-            try:
-                self._track_page(cursor, pageid, title)
-            except Exception:
-                e = "Error tracking page [[{0}]] (id: {1})"
-                self.logger.exception(e.format(title, pageid))
+            untracked.append((pageid, latest, title))
+
+        e = "Error tracking page [[{0}]] (id: {1})"
+        minimum = 1
+        for batch in _chunks(untracked, _REPLICA_BATCH_SIZE):
+            pages = [(pageid, title, latest) for (pageid, latest, title) in batch]
+            self._prefetch_pages(cursor, pages)
+            count = self._process_chunks(self._track_page, pages, e, minimum)
+            if count < len(pages):
+                self.logger.info("Sync budget spent; leaving pages untracked")
+                return since
+            minimum = 0
+
+        return str(mark) if mark else since
+
+    def _process_chunks(self, method, pages, error, minimum=0):
+        """Call self._process_pages() for chunks of pages until the deadline.
+
+        Pages are processed max(_SYNC_CHUNK_SIZE, self.workers) at a time, and
+        no more chunks are started once the sync's deadline has passed, unless
+        fewer than 'minimum' pages have been processed. Returns the number of
+        pages processed, which are the first ones in 'pages'. The caller
+        should have given all of 'pages' to self._prefetch_pages() already.
+        """
+        size = max(_SYNC_CHUNK_SIZE, self.workers)
+        count = 0
+        for chunk in _chunks(pages, size):
+            if count >= minimum and time() >= self._deadline:
+                break
+            self._process_pages(method, chunk, error)
+            count += len(chunk)
+        return count
 
     def _update_stale(self, cursor):
         """Update submissions that haven't been updated in a long time.
@@ -343,158 +1028,310 @@ class AfCStatistics(Task):
         This is intended to update notes that change without typical update
         triggers, like when submitters are blocked. It also resolves conflicts
         when pages are tracked during high replag, potentially causing data to
-        be inaccurate (like a missed decline). It updates no more than the ten
-        stalest pages that haven't been updated in two days.
+        be inaccurate (like a missed decline).
+
+        Candidates are pages that haven't been updated in two days, or that
+        were last updated with more replag than we have now (and at least
+        _STALE_REPLAG_MIN seconds). Each kind is selected separately, up to
+        _STALE_CANDIDATES of the most stale, so both queries can use an index,
+        and they are ranked here. They are refreshed in order of priority
+        (see _STALE_PENDING_BONUS and _STALE_REPLAG_WEIGHT) until the sync's
+        time budget runs out, though at least _MIN_STALE_PAGES are always
+        refreshed (see self._process_chunks()). Pages with changes waiting in
+        the write buffer are skipped.
         """
         self.logger.debug("Updating stale submissions")
-        query = """SELECT page_id, page_title, page_modify_oldid
-                   FROM page JOIN updatelog ON page_id = update_id
-                   WHERE ADDTIME(update_time, '48:00:00') < NOW()
-                   ORDER BY update_time ASC LIMIT 10"""
-        cursor.execute(query)
-
-        for pageid, title, oldid in cursor:
+        query = """SELECT page_id, page_title, page_modify_oldid, row_chart,
+                   TIMESTAMPDIFF(SECOND, update_time, NOW()), update_replag
+                   FROM page JOIN row ON page_id = row_id
+                   JOIN updatelog ON page_id = update_id"""
+        by_time = """ WHERE update_time < NOW() - INTERVAL 48 HOUR
+                      ORDER BY update_time LIMIT ?"""
+        by_replag = """ WHERE update_replag > ?
+                        ORDER BY update_replag DESC LIMIT ?"""
+
+        stale = {}
+        cursor.execute(query + by_time, (_STALE_CANDIDATES,))
+        stale.update((row[0], row) for row in cursor.fetchall())
+        min_replag = max(self.replag, _STALE_REPLAG_MIN)
+        cursor.execute(query + by_replag, (min_replag, _STALE_CANDIDATES))
+        stale.update((row[0], row) for row in cursor.fetchall())
+
+        def priority(row):
+            _, _, _, chart, age, replag = row
+            bonus = _STALE_PENDING_BONUS if chart == self.CHART_PEND else 0
+            return age + bonus + replag * _STALE_REPLAG_WEIGHT
+
+        ranked = sorted(stale.values(), key=priority, reverse=True)
+        candidates = [
+            row[:3] for row in ranked[:_STALE_CANDIDATES] if row[0] not in self.buffer
+        ]
+
+        e = "Error updating page [[{0}]] (id: {1})"
+        latest = self._get_latest_batch([pageid for (pageid, _, _) in candidates])
+        pages = []
+        for pageid, title, oldid in candidates:
             msg = "Updating page [[{0}]] (id: {1}) @ {2}"
             self.logger.debug(msg.format(title, pageid, oldid))
-            try:
-                self._update_page(cursor, pageid, title)
-            except Exception:
-                e = "Error updating page [[{0}]] (id: {1})"
-                self.logger.exception(e.format(title, pageid))
+            pages.append((pageid, title, latest.get(pageid, (None,))[0]))
+        self._prefetch_pages(cursor, pages)
+        method = self._update_page
+        count = self._process_chunks(method, pages, e, _MIN_STALE_PAGES)
+
+        msg = "Refreshed {0} of {1} stale submissions"
+        self.logger.debug(msg.format(count, len(candidates)))
 
     def _delete_old(self, cursor):
         """Remove old submissions from the database.
 
         "Old" is defined as a submission that has been declined or accepted
-        more than 36 hours ago. Pending submissions cannot be "old".
+        more than 36 hours ago. Pending submissions cannot be "old". Stored
+        submission records and creations of pages we no longer track are
+        removed as well.
         """
         self.logger.debug("Removing old submissions from chart")
-        query = """DELETE FROM page, row, updatelog USING page JOIN row
-                   ON page_id = row_id JOIN updatelog ON page_id = update_id
-                   WHERE row_chart IN (?, ?)
-                   AND ADDTIME(page_special_time, '36:00:00') < NOW()"""
-        cursor.execute(query, (self.CHART_ACCEPT, self.CHART_DECLINE))
+        query1 = """DELETE FROM page, row, updatelog USING page JOIN row
+                    ON page_id = row_id JOIN updatelog ON page_id = update_id
+                    WHERE row_chart IN (?, ?)
+                    AND page_special_time < NOW() - INTERVAL 36 HOUR"""
+        query2 = """DELETE submission FROM submission
+                    LEFT JOIN page ON submission_id = page_id
+                    WHERE page_id IS NULL"""
+        query3 = """DELETE creation FROM creation
+                    LEFT JOIN page ON create_id = page_id
+                    WHERE page_id IS NULL"""
+        cursor.execute(query1, (self.CHART_ACCEPT, self.CHART_DECLINE))
+        cursor.execute(query2)
+        cursor.execute(query3)
+
+    def _clear_pages(self, cursor):
+        """Remove every tracked page from the database."""
+        self.logger.debug("Removing all submissions from chart")
+        cursor.execute("DELETE FROM updatelog")
+        cursor.execute("DELETE FROM row")
+        cursor.execute("DELETE FROM page")
+
+    def _get_state(self, cursor, key):
+        """Return a value from our database's sync state table, or None."""
+        query = "SELECT state_value FROM syncstate WHERE state_key = ?"
+        cursor.execute(query, (key,))
+        result = cursor.fetchall()
+        return result[0][0] if result else None
+
+    def _set_state(self, cursor, key, value):
+        """Store a value in our database's sync state table."""
+        query = """INSERT INTO syncstate VALUES (?, ?)
+                   ON DUPLICATE KEY UPDATE state_value = ?"""
+        cursor.execute(query, (key, value, value))
+
+    def _process_pages(self, method, pages, error):
+        """Call a page entry point, like self._update_page(), for many pages.
+
+        'pages' is a list of (pageid, title, latest revision ID) tuples, where
+        the revision ID may be None if unknown. If more than one worker is
+        configured, pages are processed concurrently by a thread pool, where
+        each worker makes its replica queries on its own connection from
+        self.replica_pool. Exceptions are logged with 'error', formatted with
+        the page's title and ID.
+
+        Information about the pages, including everything needed from our
+        database and the API, should be looked up beforehand in bulk with
+        self._prefetch_pages(), so the workers mostly wait on the replica.
+        """
+
+        def process(pageid, title, revid):
+            try:
+                method(pageid, title, revid)
+            except Exception:
+                self.logger.exception(error.format(title, pageid))
+
+        def work(page):
+            with self.replica_pool.connection() as conn:
+                self.worker_state.replica = conn
+                try:
+                    process(*page)
+                finally:
+                    self.worker_state.replica = None
+
+        self.stats.add_pages(len(pages))
+        if self.workers <= 1 or len(pages) <= 1:
+            for page in pages:
+                process(*page)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(work, pages))
+
+    def _prefetch_pages(self, cursor, pages):
+        """Look up information about many pages before they are processed.
+
+        'pages' is a list like for self._process_pages(). The content of their
+        latest revisions is loaded into the revision cache, and their stored
+        rows, last edits, remembered creations, and stored submission records
+        are looked up together, so that self._update_page(),
+        self._get_modify(), self.get_create(), and self._load_submission()
+        don't need a query for each page. So are the
+        block statuses of their submitters (see self._get_submitters()), so
+        self._is_blocked() doesn't need an API query for each one.
+        """
+        pageids = [pageid for (pageid, _, _) in pages]
+        self._prefetch_revisions([revid for (_, _, revid) in pages if revid])
+        self.page_info.update(self._get_page_batch(cursor, pageids))
+        self.modify_info.update(self._get_modify_batch(pageids))
+        self.creation_info.update(self._get_creation_batch(cursor, pageids))
+        self.submission_info.update(self._get_submission_batch(cursor, pageids))
+        revids = [(pageid, revid) for (pageid, _, revid) in pages if revid]
+        self._prefetch_blocks(self._get_submitters(revids))
+
+    def _get_page_batch(self, cursor, pageids):
+        """Return our stored information about many pages, given by ID.
+
+        The result is a dict mapping page IDs to dicts of their page and row
+        columns, for pages found in our database.
+        """
+        query = """SELECT * FROM page JOIN row ON page_id = row_id
+                   WHERE page_id IN ({0})"""
+        pages = {}
+        with cursor.connection.cursor(pymysql.cursors.DictCursor) as dict_cursor:
+            for batch in _chunks(pageids, _REPLICA_BATCH_SIZE):
+                dict_cursor.execute(query.format(", ".join("?" * len(batch))), batch)
+                for row in dict_cursor.fetchall():
+                    pages[row["page_id"]] = row
+        return pages
 
     ######################## PRIMARY PAGE ENTRY POINTS ########################
 
-    def _untrack_page(self, cursor, pageid):
+    def _untrack_page(self, pageid):
         """Remove a page, given by ID, from our database."""
         self.logger.debug(f"Untracking page (id: {pageid})")
-        query = """DELETE FROM page, row, updatelog USING page JOIN row
-                   ON page_id = row_id JOIN updatelog ON page_id = update_id
-                   WHERE page_id = ?"""
-        cursor.execute(query, (pageid,))
+        self.buffer.delete(pageid)
 
-    def _track_page(self, cursor, pageid, title):
+    def _track_page(self, pageid, title, revid=None):
         """Update hook for when page is not in our database.
 
         A variety of SQL queries are used to gather information about the page,
-        which is then saved to our database.
+        which is then saved to our database. This may be called from several
+        worker threads at once (see self._process_pages()). 'revid' is the
+        page's latest revision ID, if already known.
         """
-        content = self._get_content(pageid)
-        if content is None:
+        analysis = self._get_content(pageid, revid)
+        if analysis is None:
             msg = f"Could not get page content for [[{title}]]"
             self.logger.error(msg)
             return
 
+        memo = self._load_submission(pageid, analysis)
         namespace = self.site.get_page(title).namespace
-        status, chart = self._get_status_and_chart(content, namespace)
+        status, chart = self._get_status_and_chart(analysis, namespace)
         if chart == self.CHART_NONE:
             msg = f"Could not find a status for [[{title}]]"
             self.logger.warn(msg)
             return
 
         m_user, m_time, m_id = self._get_modify(pageid)
-        s_user, s_time, s_id = self._get_special(pageid, content, chart)
-        notes = self._get_notes(chart, content, m_time, s_user)
-
-        query1 = "INSERT INTO row VALUES (?, ?)"
-        query2 = "INSERT INTO page VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
-        query3 = "INSERT INTO updatelog VALUES (?, ?)"
-        cursor.execute(query1, (pageid, chart))
-        cursor.execute(
-            query2,
-            (
-                pageid,
-                status,
-                title,
-                len(content),
-                notes,
-                m_user,
-                m_time,
-                m_id,
-                s_user,
-                s_time,
-                s_id,
-            ),
+        special = self._get_special(pageid, analysis, chart, memo)
+        self._save_submission(pageid, analysis, chart, special, memo)
+        s_user, s_time, s_id = special
+        notes = self._get_notes(chart, analysis, m_time, s_user)
+
+        page = (
+            pageid,
+            status,
+            title,
+            len(analysis.content),
+            notes,
+            m_user,
+            m_time,
+            m_id,
+            s_user,
+            s_time,
+            s_id,
         )
-        cursor.execute(query3, (pageid, datetime.utcnow()))
+        self.buffer.insert(pageid, chart, page, (datetime.utcnow(), self.replag))
 
-    def _update_page(self, cursor, pageid, title):
+    def _update_page(self, pageid, title, revid=None):
         """Update hook for when page is already in our database.
 
         A variety of SQL queries are used to gather information about the page,
         which is compared against our stored information. Differing information
-        is then updated.
+        is then updated. Like self._track_page(), this may be called from
+        several worker threads at once; changes are written to self.buffer.
+        'revid' is the page's latest revision ID, if already known.
+
+        If the page's submission templates haven't changed since it was last
+        processed, they aren't parsed again (see self._load_submission()).
         """
-        content = self._get_content(pageid)
-        if content is None:
+        analysis = self._get_content(pageid, revid)
+        if analysis is None:
             msg = f"Could not get page content for [[{title}]]"
             self.logger.error(msg)
             return
 
+        memo = self._load_submission(pageid, analysis)
         namespace = self.site.get_page(title).namespace
-        status, chart = self._get_status_and_chart(content, namespace)
+        status, chart = self._get_status_and_chart(analysis, namespace)
         if chart == self.CHART_NONE:
-            self._untrack_page(cursor, pageid)
+            self._untrack_page(pageid)
             return
 
-        query = "SELECT * FROM page JOIN row ON page_id = row_id WHERE page_id = ?"
-        with self.conn.cursor(pymysql.cursors.DictCursor) as dict_cursor:
-            dict_cursor.execute(query, (pageid,))
-            result = dict_cursor.fetchall()[0]
+        result = self.page_info.pop(pageid, None)
+        if result is None:
+            self.logger.error(f"Could not find stored information for [[{title}]]")
+            return
 
         m_user, m_time, m_id = self._get_modify(pageid)
 
-        if title != result["page_title"]:
-            self._update_page_title(cursor, result, pageid, title)
-
-        if m_id != result["page_modify_oldid"]:
-            self._update_page_modify(
-                cursor, result, pageid, len(content), m_user, m_time, m_id
-            )
-
         if status != result["page_status"]:
-            special = self._update_page_status(
-                cursor, result, pageid, content, status, chart
-            )
+            special = self._get_special(pageid, analysis, chart, memo)
             s_user = special[0]
+            stored = special
         else:
+            special = None
             s_user = result["page_special_user"]
+            stored = (
+                s_user,
+                result["page_special_time"],
+                result["page_special_oldid"],
+            )
+        self._save_submission(pageid, analysis, chart, stored, memo)
+
+        notes = self._get_notes(chart, analysis, m_time, s_user)
+
+        if title != result["page_title"]:
+            self._update_page_title(result, pageid, title)
+
+        if m_id != result["page_modify_oldid"]:
+            size = len(analysis.content)
+            self._update_page_modify(result, pageid, size, m_user, m_time, m_id)
+
+        if special:
+            self._update_page_status(result, pageid, status, chart, special)
 
-        notes = self._get_notes(chart, content, m_time, s_user)
         if notes != result["page_notes"]:
-            self._update_page_notes(cursor, result, pageid, notes)
+            self._update_page_notes(result, pageid, notes)
 
-        query = "UPDATE updatelog SET update_time = ? WHERE update_id = ?"
-        cursor.execute(query, (datetime.utcnow(), pageid))
+        self.buffer.update(
+            pageid, update_time=datetime.utcnow(), update_replag=self.replag
+        )
 
     ###################### PAGE ATTRIBUTE UPDATE METHODS ######################
 
-    def _update_page_title(self, cursor, result, pageid, title):
+    def _update_page_title(self, result, pageid, title):
         """Update the title of a page in our database."""
-        query = "UPDATE page SET page_title = ? WHERE page_id = ?"
-        cursor.execute(query, (title, pageid))
+        self.buffer.update(pageid, page_title=title)
 
         msg = "  {0}: title: {1} -> {2}"
         self.logger.debug(msg.format(pageid, result["page_title"], title))
 
-    def _update_page_modify(self, cursor, result, pageid, size, m_user, m_time, m_id):
+    def _update_page_modify(self, result, pageid, size, m_user, m_time, m_id):
         """Update the last modified information of a page in our database."""
-        query = """UPDATE page SET page_size = ?, page_modify_user = ?,
-                   page_modify_time = ?, page_modify_oldid = ?
-                   WHERE page_id = ?"""
-        cursor.execute(query, (size, m_user, m_time, m_id, pageid))
+        self.buffer.update(
+            pageid,
+            page_size=size,
+            page_modify_user=m_user,
+            page_modify_time=m_time,
+            page_modify_oldid=m_id,
+        )
 
         msg = "  {0}: modify: {1} / {2} / {3} -> {4} / {5} / {6}"
         msg = msg.format(
@@ -508,14 +1345,9 @@ class AfCStatistics(Task):
         )
         self.logger.debug(msg)
 
-    def _update_page_status(self, cursor, result, pageid, content, status, chart):
+    def _update_page_status(self, result, pageid, status, chart, special):
         """Update the status and "specialed" information of a page."""
-        query1 = """UPDATE page JOIN row ON page_id = row_id
-                   SET page_status = ?, row_chart = ? WHERE page_id = ?"""
-        query2 = """UPDATE page SET page_special_user = ?,
-                   page_special_time = ?, page_special_oldid = ?
-                   WHERE page_id = ?"""
-        cursor.execute(query1, (status, chart, pageid))
+        self.buffer.update(pageid, page_status=status, row_chart=chart)
 
         msg = "  {0}: status: {1} ({2}) -> {3} ({4})"
         self.logger.debug(
@@ -524,9 +1356,14 @@ class AfCStatistics(Task):
             )
         )
 
-        s_user, s_time, s_id = self._get_special(pageid, content, chart)
+        s_user, s_time, s_id = special
         if s_id != result["page_special_oldid"]:
-            cursor.execute(query2, (s_user, s_time, s_id, pageid))
+            self.buffer.update(
+                pageid,
+                page_special_user=s_user,
+                page_special_time=s_time,
+                page_special_oldid=s_id,
+            )
             msg = "  {0}: special: {1} / {2} / {3} -> {4} / {5} / {6}"
             msg = msg.format(
                 pageid,
@@ -539,37 +1376,62 @@ class AfCStatistics(Task):
             )
             self.logger.debug(msg)
 
-        return s_user, s_time, s_id
-
-    def _update_page_notes(self, cursor, result, pageid, notes):
+    def _update_page_notes(self, result, pageid, notes):
         """Update the notes (or warnings) of a page in our database."""
-        query = "UPDATE page SET page_notes = ? WHERE page_id = ?"
-        cursor.execute(query, (notes, pageid))
+        self.buffer.update(pageid, page_notes=notes)
         msg = "  {0}: notes: {1} -> {2}"
         self.logger.debug(msg.format(pageid, result["page_notes"], notes))
 
     ###################### DATA RETRIEVAL HELPER METHODS ######################
 
-    def _get_content(self, pageid):
+    def _get_content(self, pageid, revid=None):
         """Get the current content of a page by ID from the API.
 
-        The page's current revision ID is retrieved from SQL, and then
-        an API query is made to get its content. This is the only API query
-        used in the task's code.
+        The page's current revision ID is retrieved from SQL, unless given as
+        'revid', and then an API query is made to get its content. The content
+        is returned as a _SubmissionAnalysis (see self._analyze()), or None if
+        the page doesn't exist.
         """
-        query = "SELECT page_latest FROM page WHERE page_id = ?"
-        result = self.site.sql_query(query, (pageid,))
-        try:
-            revid = int(list(result)[0][0])
-        except IndexError:
-            return None
-        return self._get_revision_content(revid)
+        if revid is None:
+            query = "SELECT page_latest FROM page WHERE page_id = ?"
+            result = self._sql_query(query, (pageid,))
+            try:
+                revid = int(list(result)[0][0])
+            except IndexError:
+                return None
+        return self._analyze(self._get_revision_content(revid), revid)
+
+    def _get_title(self, title, namespace):
+        """Return a page's full title, given its replica title and namespace."""
+        title = title.decode("utf8").replace("_", " ")
+        ns_name = self.site.namespace_id_to_name(namespace)
+        if ns_name:
+            title = ":".join((ns_name, title))
+        return title
+
+    def _get_latest_batch(self, pageids):
+        """Return the current state of many pages, given by ID, from SQL.
+
+        The result is a dict mapping page IDs to (latest revision ID, title,
+        namespace) tuples. Pages that no longer exist are missing from it.
+        """
+        query = """SELECT page_id, page_latest, page_title, page_namespace
+                   FROM page WHERE page_id IN ({0})"""
+        latest = {}
+        for batch in _chunks(pageids, _REPLICA_BATCH_SIZE):
+            params = ", ".join("?" * len(batch))
+            result = self._sql_query(query.format(params), batch)
+            for pageid, real_oldid, real_title, real_ns in result:
+                latest[pageid] = (real_oldid, real_title, real_ns)
+        return latest
 
     def _get_revision_content(self, revid, tries=1):
         """Get the content of a revision by ID from the API."""
-        if revid in self.revision_cache:
-            return self.revision_cache[revid]
-        res = self.site.api_query(
+        content = self.revision_cache.get(revid)
+        self.stats.hit("revision", content is not None)
+        if content is not None:
+            return content
+        res = self._api_query(
             action="query",
             prop="revisions",
             rvprop="content",
@@ -577,7 +1439,7 @@ class AfCStatistics(Task):
             revids=revid,
         )
         try:
-            revision = res["query"]["pages"].values()[0]["revisions"][0]
+            revision = list(res["query"]["pages"].values())[0]["revisions"][0]
             content = revision["slots"]["main"]["*"]
         except KeyError:
             if tries == 0:
@@ -587,7 +1449,110 @@ class AfCStatistics(Task):
         self.revision_cache[revid] = content
         return content
 
-    def _get_status_and_chart(self, content, namespace):
+    def _prefetch_revisions(self, revids):
+        """Load the content of many revisions by ID into the revision cache.
+
+        Revisions that are already cached are skipped. The rest are requested
+        from the API _API_REVISION_LIMIT at a time. Revisions that can't be
+        loaded here (deleted, suppressed, or an API error) are left out, so
+        self._get_revision_content() will retry them individually later.
+        """
+        missing = {revid for revid in revids if revid not in self.revision_cache}
+        for batch in _chunks(sorted(missing), _API_REVISION_LIMIT):
+            try:
+                res = self._api_query(
+                    action="query",
+                    prop="revisions",
+                    rvprop="ids|content",
+                    rvslots="main",
+                    revids="|".join(str(revid) for revid in batch),
+                )
+            except exceptions.APIError:
+                msg = "API error while prefetching {0} revisions"
+                self.logger.exception(msg.format(len(batch)))
+                continue
+            for page in res["query"].get("pages", {}).values():
+                for revision in page.get("revisions", []):
+                    try:
+                        content = revision["slots"]["main"]["*"]
+                    except KeyError:
+                        continue
+                    self.revision_cache[revision["revid"]] = content
+        self.revision_cache.flush()
+
+    def _get_submitters(self, revids):
+        """Return the set of users who submitted the given revisions.
+
+        'revids' is a list of (pageid, revid) tuples. Only pending submissions
+        count. Revisions missing from the revision cache are skipped. Stored
+        submission records in self.submission_info are used where they still
+        match, so unchanged pages aren't parsed.
+        """
+        users = set()
+        for pageid, revid in revids:
+            content = self.revision_cache.get(revid)
+            if content is None:
+                continue
+            analysis = self._analyze(content, revid)
+            stored = self.submission_info.get(pageid)
+            if stored and stored[0] == analysis.region_hash:
+                analysis.restore(stored[1])
+            for status, params in analysis.submissions:
+                user = params.get("u", "").strip()
+                if status in ("P", "") and user:
+                    users.add(user)
+        return users
+
+    def _prefetch_blocks(self, usernames):
+        """Load the block status of many users into the block cache.
+
+        Users with a fresh cache entry are skipped. The rest are looked up
+        with list=blocks, _API_BLOCK_LIMIT at a time. If a batch can't be
+        loaded, its users are left out, so self._is_blocked() will look them
+        up individually later. The cache is keyed by normalized username.
+        """
+        usernames = {_normalize_username(user) for user in usernames}
+        missing = [user for user in usernames if self._get_cached_block(user) is None]
+        for batch in _chunks(sorted(missing), _API_BLOCK_LIMIT):
+            try:
+                res = self._api_query(
+                    action="query",
+                    list="blocks",
+                    bkusers="|".join(batch),
+                    bkprop="user",
+                    bklimit="max",
+                )
+            except exceptions.APIError:
+                msg = "API error while prefetching blocks for {0} users"
+                self.logger.exception(msg.format(len(batch)))
+                continue
+            blocked = {
+                _normalize_username(block["user"]) for block in res["query"]["blocks"]
+            }
+            now = time()
+            for user in batch:
+                self.block_cache[user] = (user in blocked, now)
+
+    def _get_cached_block(self, username):
+        """Return whether a user is blocked from the cache, or None if stale."""
+        cached = self.block_cache.get(_normalize_username(username))
+        if cached and time() - cached[1] < self.block_cache_ttl:
+            return cached[0]
+        return None
+
+    def _is_blocked(self, username):
+        """Return whether the given user is currently blocked."""
+        blocked = self._get_cached_block(username)
+        self.stats.hit("block", blocked is not None)
+        if blocked is None:
+            try:
+                blocked = bool(self.site.get_user(username).blockinfo)
+            except exceptions.UserNotFoundError:  # Likely an IP
+                blocked = False
+            self.block_cache[_normalize_username(username)] = (blocked, time())
+        return blocked
+
+    def _get_status_and_chart(self, analysis, namespace):
         """Determine the status and chart number of an AfC submission.
 
         The methodology used here is the same one I've been using for years
@@ -597,7 +1562,7 @@ class AfCStatistics(Task):
         use (revision history search to find the most recent isn't a viable
         idea :P).
         """
-        statuses = self.get_statuses(content)
+        statuses = analysis.statuses
         if namespace == wiki.NS_MAIN:
             if statuses:
                 return None, self.CHART_MISPLACE
@@ -614,46 +1579,61 @@ class AfCStatistics(Task):
 
     def get_statuses(self, content):
         """Return a list of all AfC submission statuses in a page's text."""
-        valid = ["P", "R", "T", "D"]
-        aliases = {
-            "submit": "P",
-            "afc submission/submit": "P",
-            "afc submission/reviewing": "R",
-            "afc submission/pending": "P",
-            "afc submission/draft": "T",
-            "afc submission/declined": "D",
-        }
-        statuses = []
-        code = mwparserfromhell.parse(content)
-        for template in code.filter_templates():
-            name = template.name.strip().lower()
-            if name == "afc submission":
-                if template.has(1, ignore_empty=True):
-                    status = template.get(1).value.strip().upper()
-                    statuses.append(status if status in valid else "P")
-                else:
-                    statuses.append("P")
-            elif name in aliases:
-                statuses.append(aliases[name])
-        return statuses
+        return list(self._analyze(content).statuses)
+
+    def _analyze(self, content, revid=None):
+        """Return a _SubmissionAnalysis of the given page content.
+
+        'content' may also be an existing analysis, which is returned as-is.
+        If a revision ID is given, the analysis is memoized by it, so each
+        revision is only parsed once.
+        """
+        if isinstance(content, _SubmissionAnalysis):
+            return content
+        if revid is None:
+            return _SubmissionAnalysis(content, self.stats)
+        analysis = self.analysis_cache.get(revid)
+        self.stats.hit("analysis", analysis is not None)
+        if analysis is None:
+            analysis = _SubmissionAnalysis(content, self.stats)
+            self.analysis_cache[revid] = analysis
+        return analysis
 
     def _get_modify(self, pageid):
         """Return information about a page's last edit ("modification").
 
         This consists of the most recent editor, modification time, and the
-        lastest revision ID.
+        lastest revision ID. Information prefetched by self._prefetch_pages()
+        is used if available.
         """
-        query = """SELECT actor_name, rev_timestamp, rev_id
+        modify = self.modify_info.pop(pageid, None)
+        self.stats.hit("modify", modify is not None)
+        if modify is None:
+            modify = self._get_modify_batch([pageid])[pageid]
+        return modify
+
+    def _get_modify_batch(self, pageids):
+        """Return information about the last edits of many pages, given by ID.
+
+        The result is a dict mapping page IDs to (editor, modification time,
+        latest revision ID) tuples. Pages that no longer exist are missing
+        from it.
+        """
+        query = """SELECT page_id, actor_name, rev_timestamp, rev_id
                    FROM revision
                    JOIN page ON rev_id = page_latest
                    JOIN actor ON rev_actor = actor_id
-                   WHERE page_id = ?"""
-        result = self.site.sql_query(query, (pageid,))
-        m_user, m_time, m_id = list(result)[0]
-        timestamp = datetime.strptime(m_time, "%Y%m%d%H%M%S")
-        return m_user.decode("utf8"), timestamp, m_id
-
-    def _get_special(self, pageid, content, chart):
+                   WHERE page_id IN ({0})"""
+        modify = {}
+        for batch in _chunks(pageids, _REPLICA_BATCH_SIZE):
+            params = ", ".join("?" * len(batch))
+            result = self._sql_query(query.format(params), batch)
+            for pageid, m_user, m_time, m_id in result:
+                timestamp = datetime.strptime(m_time, "%Y%m%d%H%M%S")
+                modify[pageid] = (m_user.decode("utf8"), timestamp, m_id)
+        return modify
+
+    def _get_special(self, pageid, content, chart, memo=None):
         """Return information about a page's "special" edit.
 
         I tend to use the term "special" as a verb a lot, which is bound to
@@ -666,7 +1646,16 @@ class AfCStatistics(Task):
         its revision ID. If the page's status is not something that involves
         "special"-ing, we will return None for all three. The same will be
         returned if we cannot determine when the page was "special"-ed.
+
+        'memo' is a (chart, special info) pair from self._load_submission().
+        Pending, reviewing, and declined submissions are "special"-ed by their
+        templates, so if those are unchanged and the chart is the same, the
+        stored information is reused without searching the page's history.
         """
+        reusable = (self.CHART_PEND, self.CHART_REVIEW, self.CHART_DECLINE)
+        if memo and memo[0] == chart and chart in reusable:
+            return memo[1]
+
         charts = {
             self.CHART_NONE: (lambda pageid, content: None, None, None),
             self.CHART_MISPLACE: self.get_create,
@@ -677,19 +1666,151 @@ class AfCStatistics(Task):
         }
         return charts[chart](pageid, content)
 
+    def _load_submission(self, pageid, analysis):
+        """Reuse the stored parse of a page's submission templates, if any.
+
+        If the template region of 'analysis' (see _SubmissionAnalysis.region())
+        hashes the same as when we stored it in our database's submission
+        table, which self._prefetch_pages() loads into self.submission_info,
+        its statuses and submissions are restored from there instead of
+        parsing the content again. Returns the stored (chart, special info)
+        for self._get_special(), or None if nothing could be reused.
+        """
+        stored = self.submission_info.pop(pageid, None)
+        if not stored or stored[0] != analysis.region_hash:
+            self.stats.hit("submission", False)
+            return None
+        self.stats.hit("submission", True)
+        _, record, chart, s_user, s_time, s_id = stored
+        analysis.restore(record)
+        return chart, (s_user, s_time, s_id)
+
+    def _save_submission(self, pageid, analysis, chart, special, memo):
+        """Store the parse of a page's submission templates for reuse.
+
+        The record is written to self.buffer. Nothing is written if the page's
+        stored record was reused ('memo') and its chart and special
+        information haven't changed.
+        """
+        if memo == (chart, special) or analysis.region_hash is None:
+            return
+        row = (pageid, analysis.region_hash, analysis.record, chart) + tuple(special)
+        self.buffer.remember("submission", row)
+
+    def _get_submission_batch(self, cursor, pageids):
+        """Return the stored submission records of many pages, given by ID.
+
+        The result is a dict mapping page IDs to (region hash, record, chart,
+        special user, special time, special revid) tuples, for pages found in
+        our database's submission table.
+        """
+        query = """SELECT submission_id, submission_hash, submission_record,
+                   submission_chart, submission_special_user,
+                   submission_special_time, submission_special_oldid
+                   FROM submission WHERE submission_id IN ({0})"""
+        submissions = {}
+        for batch in _chunks(pageids, _REPLICA_BATCH_SIZE):
+            cursor.execute(query.format(", ".join("?" * len(batch))), batch)
+            for row in cursor.fetchall():
+                submissions[row[0]] = tuple(row[1:])
+        return submissions
+
     def get_create(self, pageid, content=None):
-        """Return (creator, create_ts, create_revid) for the given page."""
+        """Return (creator, create_ts, create_revid) for the given page.
+
+        A page's first revision rarely changes, so this is remembered in our
+        database's creation table, which self._prefetch_pages() loads into
+        self.creation_info. A remembered revision is reused as long as it
+        still exists; otherwise, it is looked up again and the new one is
+        written to self.buffer.
+        """
+        query = "SELECT 1 FROM revision WHERE rev_id = ? AND rev_page = ?"
+
+        create = self.creation_info.pop(pageid, None)
+        if create:
+            if self._sql_query(query, (create[2], pageid)):
+                self.stats.hit("creation", True)
+                return create
+            msg = "  {0}: creation revision {1} is gone"
+            self.logger.debug(msg.format(pageid, create[2]))
+
+        self.stats.hit("creation", False)
+        create = self._get_create_from_replica(pageid)
+        self.buffer.remember("creation", (pageid,) + create)
+        return create
+
+    def _get_creation_batch(self, cursor, pageids):
+        """Return the remembered creations of many pages, given by ID.
+
+        The result is a dict mapping page IDs to (creator, create_ts,
+        create_revid) tuples, for pages found in our database's creation table.
+        """
+        query = """SELECT create_id, create_user, create_time, create_oldid
+                   FROM creation WHERE create_id IN ({0})"""
+        creation = {}
+        for batch in _chunks(pageids, _REPLICA_BATCH_SIZE):
+            cursor.execute(query.format(", ".join("?" * len(batch))), batch)
+            for pageid, c_user, c_time, c_id in cursor.fetchall():
+                creation[pageid] = (c_user, c_time, c_id)
+        return creation
+
+    def _get_create_from_replica(self, pageid):
+        """Look up (creator, create_ts, create_revid) for a page from SQL."""
         query = """SELECT actor_name, rev_timestamp, rev_id
                    FROM revision
                    JOIN actor ON rev_actor = actor_id
                    WHERE rev_id = (SELECT MIN(rev_id) FROM revision WHERE rev_page = ?)"""
-        result = self.site.sql_query(query, (pageid,))
+        result = self._sql_query(query, (pageid,))
         c_user, c_time, c_id = list(result)[0]
         timestamp = datetime.strptime(c_time, "%Y%m%d%H%M%S")
         return c_user.decode("utf8"), timestamp, c_id
 
     def get_accepted(self, pageid, content=None):
-        """Return (acceptor, accept_ts, accept_revid) for the given page."""
+        """Return (acceptor, accept_ts, accept_revid) for the given page.
+
+        The page's most recent move is found in the move log, falling back on
+        a search of its edit summaries if that fails or its revision can't be
+        found. Results are remembered for _ACCEPT_CACHE_TTL seconds, unless
+        nothing was found, since the move may just not be replicated yet.
+        """
+        cached = self.accept_cache.get(pageid)
+        fresh = cached and time() - cached[1] < _ACCEPT_CACHE_TTL
+        self.stats.hit("accept", bool(fresh))
+        if fresh:
+            return cached[0]
+
+        result = self._get_accepted_from_log(pageid)
+        if not result[2]:
+            result = self._get_accepted_from_comments(pageid)
+        if result[0]:
+            self.accept_cache[pageid] = (result, time())
+        return result
+
+    def _get_accepted_from_log(self, pageid):
+        """Look up a page's acceptance using the move log.
+
+        The revision ID is that of the null revision created by the move,
+        taken to be the page's first revision at or after the log entry, or
+        None if there is none.
+        """
+        query = """SELECT actor_name, log_timestamp,
+                   (SELECT rev_id FROM revision
+                    WHERE rev_page = log_page AND rev_timestamp >= log_timestamp
+                    ORDER BY rev_timestamp, rev_id LIMIT 1)
+                   FROM logging_logindex
+                   JOIN actor ON log_actor = actor_id
+                   WHERE log_page = ? AND log_type = "move"
+                   ORDER BY log_timestamp DESC LIMIT 1"""
+        result = self._sql_query(query, (pageid,))
+        try:
+            a_user, a_time, a_id = list(result)[0]
+        except IndexError:
+            return None, None, None
+        timestamp = datetime.strptime(a_time, "%Y%m%d%H%M%S")
+        return a_user.decode("utf8"), timestamp, a_id
+
+    def _get_accepted_from_comments(self, pageid):
+        """Look up a page's acceptance by searching its edit summaries."""
         query = """SELECT actor_name, rev_timestamp, rev_id
                    FROM revision
                    JOIN actor ON rev_actor = actor_id
@@ -697,7 +1818,7 @@ class AfCStatistics(Task):
                    WHERE rev_page = ?
                    AND comment_text LIKE "% moved page [[%]] to [[%]]%"
                    ORDER BY rev_timestamp DESC LIMIT 1"""
-        result = self.site.sql_query(query, (pageid,))
+        result = self._sql_query(query, (pageid,))
         try:
             a_user, a_time, a_id = list(result)[0]
         except IndexError:
@@ -725,14 +1846,10 @@ class AfCStatistics(Task):
     def _get_status_helper(self, pageid, content, statuses, params):
         """Helper function for get_pending() and get_decline()."""
         submits = []
-        code = mwparserfromhell.parse(content)
-        for tmpl in code.filter_templates():
-            status = tmpl.get(1).value.strip().upper() if tmpl.has(1) else "P"
-            if tmpl.name.strip().lower() == "afc submission":
-                if all([tmpl.has(par, ignore_empty=True) for par in params]):
-                    if status in statuses:
-                        data = [str(tmpl.get(par).value) for par in params]
-                        submits.append(data)
+        for status, tmpl_params in self._analyze(content).submissions:
+            if all([tmpl_params.get(par, "").strip() for par in params]):
+                if status in statuses:
+                    submits.append([tmpl_params[par] for par in params])
         if not submits:
             return None
         user, stamp = max(submits, key=lambda pair: pair[1])
@@ -742,7 +1859,7 @@ class AfCStatistics(Task):
                    JOIN actor ON rev_actor = actor_id
                    WHERE rev_page = ? AND actor_name = ? AND ABS(rev_timestamp - ?) <= 60
                    ORDER BY ABS(rev_timestamp - ?) ASC LIMIT 1"""
-        result = self.site.sql_query(query, (pageid, user, stamp, stamp))
+        result = self._sql_query(query, (pageid, user, stamp, stamp))
         try:
             dtime = datetime.strptime(stamp, "%Y%m%d%H%M%S")
             return user, dtime, list(result)[0][0]
@@ -752,41 +1869,142 @@ class AfCStatistics(Task):
     def _search_history(self, pageid, chart, search_with, search_without):
         """Search through a page's history to find when a status was set.
 
-        Linear search backwards in time for the edit right after the most
-        recent edit that fails the (pseudocode) test:
+        Search backwards in time for the edit right after the most recent
+        edit that fails the (pseudocode) test:
 
         ``status_set(any(search_with)) && !status_set(any(search_without))``
+
+        How the search is done depends on self.history_search; see
+        self._search_history_linear() and self._search_history_binary().
         """
         query = """SELECT actor_name, rev_timestamp, rev_id
                    FROM revision
                    JOIN actor ON rev_actor = actor_id
                    WHERE rev_page = ? ORDER BY rev_id DESC"""
-        result = self.site.sql_query(query, (pageid,))
-
-        counter = 0
-        last = (None, None, None)
-        for user, ts, revid in result:
-            counter += 1
-            if counter > 50:
-                msg = "Exceeded 50 content lookups while searching history of page (id: {0}, chart: {1})"
-                self.logger.warn(msg.format(pageid, chart))
-                return None, None, None
-            try:
-                content = self._get_revision_content(revid)
-            except exceptions.APIError:
-                msg = "API error interrupted SQL query in _search_history() for page (id: {0}, chart: {1})"
-                self.logger.exception(msg.format(pageid, chart))
-                return None, None, None
-            statuses = self.get_statuses(content)
-            req = search_with and not any([s in statuses for s in search_with])
-            if any([s in statuses for s in search_without]) or req:
-                return last
-            timestamp = datetime.strptime(ts, "%Y%m%d%H%M%S")
-            last = (user.decode("utf8"), timestamp, revid)
+        history = self._sql_query(query, (pageid,))
 
-        return last
+        if self.history_search == "linear":
+            search = self._search_history_linear
+        else:
+            search = self._search_history_binary
+        try:
+            index = search(pageid, chart, history, search_with, search_without)
+        except exceptions.APIError:
+            msg = "API error interrupted SQL query in _search_history() for page (id: {0}, chart: {1})"
+            self.logger.exception(msg.format(pageid, chart))
+            return None, None, None
 
-    def _get_notes(self, chart, content, m_time, s_user):
+        if index is None or index < 0:
+            return None, None, None
+        user, ts, revid = history[index]
+        timestamp = datetime.strptime(ts, "%Y%m%d%H%M%S")
+        return user.decode("utf8"), timestamp, revid
+
+    def _search_history_linear(
+        self, pageid, chart, history, search_with, search_without
+    ):
+        """Linear search through a page's history, for _search_history().
+
+        Revisions are checked in order, newest first, giving up after 50. Up to
+        _HISTORY_PROBES of them are fetched with each content query. Returns
+        the index of the matching revision in the history, -1 if the latest
+        revision fails the test, or None if we gave up.
+        """
+        limit = min(len(history), 50)
+        for start in range(0, limit, _HISTORY_PROBES):
+            batch = history[start : min(start + _HISTORY_PROBES, limit)]
+            revids = [revid for (_, _, revid) in batch]
+            results = self._check_history(revids, search_with, search_without)
+            for index, revid in enumerate(revids, start):
+                if not results[revid]:
+                    return index - 1
+        if len(history) > limit:
+            msg = "Exceeded 50 content lookups while searching history of page (id: {0}, chart: {1})"
+            self.logger.warn(msg.format(pageid, chart))
+            return None
+        return len(history) - 1
+
+    def _search_history_binary(
+        self, pageid, chart, history, search_with, search_without
+    ):
+        """Galloping/binary search through a page's history.
+
+        This assumes the test in _search_history() is monotonic: it passes for
+        every revision since the status was set, and fails for the revision
+        just before. That isn't true of drafts that were resubmitted or
+        reviewed more than once, where a short failing stretch can be skipped
+        over, so this is only used if self.history_search is "binary".
+
+        We first probe revisions 0, 1, 3, 7, ... back from the latest until
+        one fails, then narrow down the gap between the last passing and first
+        failing revisions. Each round checks up to _HISTORY_PROBES revisions
+        with one content query, so the whole search needs O(log n) content
+        lookups.
+
+        Returns the index of the matching revision in the history, or -1 if
+        the latest revision fails the test.
+        """
+        good, bad = -1, len(history)
+        gallop = lookups = 0
+
+        while bad == len(history) and good < len(history) - 1:
+            probes = []
+            while len(probes) < _HISTORY_PROBES and gallop < len(history):
+                probes.append(gallop)
+                gallop = gallop * 2 + 1
+            if not probes:
+                probes = [len(history) - 1]
+            lookups += len(probes)
+            good, bad = self._probe_history(
+                history, probes, good, bad, search_with, search_without
+            )
+
+        while bad - good > 1:
+            count = min(_HISTORY_PROBES, bad - good - 1)
+            step = (bad - good) / (count + 1)
+            probes = sorted({good + max(1, int(step * i)) for i in range(1, count + 1)})
+            lookups += len(probes)
+            good, bad = self._probe_history(
+                history, probes, good, bad, search_with, search_without
+            )
+
+        msg = "Searched history of page (id: {0}, chart: {1}) with {2} lookups over {3} revisions"
+        self.logger.debug(msg.format(pageid, chart, lookups, len(history)))
+        return good
+
+    def _probe_history(self, history, probes, good, bad, search_with, search_without):
+        """Check some revisions for _search_history_binary().
+
+        Given a sorted list of history indices to probe, returns the new
+        (good, bad) bounds: the last index known to pass the test and the first
+        index known to fail it.
+        """
+        revids = [history[index][2] for index in probes]
+        results = self._check_history(revids, search_with, search_without)
+        for index, revid in zip(probes, revids):
+            if results[revid]:
+                good = max(good, index)
+            else:
+                bad = min(bad, index)
+                break
+        return good, bad
+
+    def _check_history(self, revids, search_with, search_without):
+        """Return which of the given revisions pass the _search_history() test.
+
+        The revisions' content is fetched with one API query where possible.
+        The result is a dict mapping revision IDs to booleans.
+        """
+        self._prefetch_revisions(revids)
+        results = {}
+        for revid in revids:
+            content = self._get_revision_content(revid)
+            statuses = self._analyze(content, revid).statuses
+            req = search_with and not any([s in statuses for s in search_with])
+            results[revid] = not (any([s in statuses for s in search_without]) or req)
+        return results
+
+    def _get_notes(self, chart, analysis, m_time, s_user):
         """Return any special notes or warnings about this page.
 
         copyvio:    submission is a suspected copyright violation
@@ -806,32 +2024,24 @@ class AfCStatistics(Task):
 
         if chart == self.CHART_DECLINE:
             # Decline is special, as only the rejected note is meaningful
-            code = mwparserfromhell.parse(content)
-            for tmpl in code.filter_templates():
-                if tmpl.name.strip().lower() == "afc submission":
-                    if tmpl.has("reject") and tmpl.get("reject").value:
-                        notes += "|nj=1"  # Submission was rejected
-                        break
+            if analysis.rejected:
+                notes += "|nj=1"  # Submission was rejected
             return notes
 
         copyvios = self.config.tasks.get("afc_copyvios", {})
-        regex = r"\{\{s*" + copyvios.get("template", "AfC suspected copyvio")
-        if re.search(regex, content):
+        if analysis.has_template(copyvios.get("template", "AfC suspected copyvio")):
             notes += "|nc=1"  # Submission is a suspected copyvio
 
-        if not re.search(r"\<ref\s*(.*?)\>(.*?)\</ref\>", content, re.I | re.S):
-            regex = r"(https?:)|\[//(?!{0})([^ \]\t\n\r\f\v]+?)"
-            sitedomain = re.escape(self.site.domain)
-            if re.search(regex.format(sitedomain), content, re.I | re.S):
+        if not analysis.has_references:
+            if analysis.has_links(self.site.domain):
                 notes += "|ni=1"  # Submission has no inline citations
             else:
                 notes += "|nu=1"  # Submission is completely unsourced
 
-        if len(content) < 1000:
+        if len(analysis.content) < 1000:
             notes += "|ns=1"  # Submission is short
 
-        statuses = self.get_statuses(content)
-        if "D" in statuses and chart != self.CHART_MISPLACE:
+        if "D" in analysis.statuses and chart != self.CHART_MISPLACE:
             notes += "|nr=1"  # Submission was resubmitted
 
         time_since_modify = (datetime.utcnow() - m_time).total_seconds()
@@ -839,12 +2049,630 @@ class AfCStatistics(Task):
         if time_since_modify > max_time:
             notes += "|no=1"  # Submission hasn't been touched in over 4 days
 
-        if chart == self.CHART_PEND and s_user:
-            submitter = self.site.get_user(s_user)
-            try:
-                if submitter.blockinfo:
-                    notes += "|nb=1"  # Submitter is blocked
-            except exceptions.UserNotFoundError:  # Likely an IP
-                pass
+        if chart == self.CHART_PEND and s_user and self._is_blocked(s_user):
+            notes += "|nb=1"  # Submitter is blocked
 
         return notes
+
+
+class _LRUCache:
+    """A thread-safe mapping that holds at most a fixed number of items.
+
+    When full, the least recently used item is evicted to make room.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._data[key]
+            self._data.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self._size:
+                self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        """Return the value for 'key' if it is cached, else 'default'."""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class _RevisionCache:
+    """A size-bounded cache of revision content, keyed by revision ID.
+
+    The most recently used revisions are kept in memory. If a path is given,
+    revisions are also stored (compressed) in an SQLite database there, which
+    survives between runs. Revision content never changes, so entries are
+    only ever evicted to stay within the size limits, least recently used
+    first.
+
+    Writes to the database (new revisions and access times) are held in
+    memory and applied together in one transaction by flush(), which is
+    called automatically once FLUSH_SIZE of them are waiting.
+    """
+
+    FLUSH_SIZE = 500
+
+    def __init__(self, size, path=None, disk_size=None):
+        self._memory = _LRUCache(size)
+        self._disk_size = disk_size
+        self._lock = Lock()
+        self._db = None
+        self._disk_count = 0
+        self._pending = {}
+        self._accessed = {}
+        if path:
+            self._open(path)
+
+    def __contains__(self, revid):
+        return self.get(revid) is not None
+
+    def __getitem__(self, revid):
+        content = self.get(revid)
+        if content is None:
+            raise KeyError(revid)
+        return content
+
+    def __setitem__(self, revid, content):
+        self._memory[revid] = content
+        if not self._db:
+            return
+        data = zlib.compress(content.encode("utf8"))
+        with self._lock:
+            self._pending[revid] = (data, time())
+            self._flush_if_full()
+
+    def _open(self, path):
+        """Open the on-disk cache database, creating it if necessary."""
+        self._db = sqlite3.connect(expanduser(path), check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS revision (
+                   rev_id INTEGER PRIMARY KEY,
+                   rev_content BLOB NOT NULL,
+                   rev_access REAL NOT NULL)"""
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS rev_access_idx ON revision (rev_access)"
+            )
+        (self._disk_count,) = self._db.execute(
+            "SELECT COUNT(*) FROM revision"
+        ).fetchone()
+
+    def _evict(self):
+        """Remove the least recently used revisions if the disk cache is full.
+
+        We evict an extra tenth of the limit at a time so that this isn't
+        needed on every insert.
+        """
+        if not self._disk_size or self._disk_count <= self._disk_size:
+            return
+        excess = self._disk_count - self._disk_size + self._disk_size // 10
+        query = """DELETE FROM revision WHERE rev_id IN (
+                   SELECT rev_id FROM revision ORDER BY rev_access ASC LIMIT ?)"""
+        self._db.execute(query, (excess,))
+        (self._disk_count,) = self._db.execute(
+            "SELECT COUNT(*) FROM revision"
+        ).fetchone()
+
+    def get(self, revid):
+        """Return the content of a revision if it is cached, else None."""
+        content = self._memory.get(revid)
+        if content is not None or not self._db:
+            return content
+
+        query = "SELECT rev_content FROM revision WHERE rev_id = ?"
+        with self._lock:
+            if revid in self._pending:
+                data = self._pending[revid][0]
+            else:
+                row = self._db.execute(query, (revid,)).fetchone()
+                if not row:
+                    return None
+                data = row[0]
+                self._accessed[revid] = time()
+                self._flush_if_full()
+        content = zlib.decompress(data).decode("utf8")
+        self._memory[revid] = content
+        return content
+
+    def _flush_if_full(self):
+        """Flush waiting writes if there are enough of them; needs the lock."""
+        if len(self._pending) + len(self._accessed) >= self.FLUSH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        """Apply waiting writes to the database; needs the lock."""
+        if not self._db or not (self._pending or self._accessed):
+            return
+        query1 = """INSERT OR IGNORE INTO revision (rev_id, rev_content, rev_access)
+                    VALUES (?, ?, ?)"""
+        query2 = "UPDATE revision SET rev_access = ? WHERE rev_id = ?"
+        inserts = [(revid, data, ts) for revid, (data, ts) in self._pending.items()]
+        updates = [(ts, revid) for revid, ts in self._accessed.items()]
+        with self._db:
+            if inserts:
+                cursor = self._db.executemany(query1, inserts)
+                self._disk_count += max(cursor.rowcount, 0)
+            if updates:
+                self._db.executemany(query2, updates)
+            self._evict()
+        self._pending.clear()
+        self._accessed.clear()
+
+    def flush(self):
+        """Write new revisions and access times to the on-disk database."""
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """Close the on-disk cache database, if we have one."""
+        with self._lock:
+            if self._db:
+                self._flush()
+                self._db.close()
+                self._db = None
+
+
+class _SubmissionAnalysis:
+    """Facts about a single revision of an AfC submission.
+
+    The revision's content is parsed with mwparserfromhell at most once, the
+    first time a template-derived attribute (statuses, submissions, rejected)
+    is needed, and only if a quick scan of its template names finds one we
+    care about. Other facts are found with regular expressions and remembered.
+
+    The parse results can also be saved as a compact record and restored
+    into an analysis of a later revision whose template region is the same.
+    """
+
+    VALID_STATUSES = ["P", "R", "T", "D"]
+    STATUS_ALIASES = {
+        "submit": "P",
+        "afc submission/submit": "P",
+        "afc submission/reviewing": "R",
+        "afc submission/pending": "P",
+        "afc submission/draft": "T",
+        "afc submission/declined": "D",
+    }
+    TEMPLATE_NAMES = {"afc submission"} | set(STATUS_ALIASES)
+
+    # Used to find candidate templates without parsing the content:
+    CANDIDATE_GATE = re.compile(r"\{\{\s*(?:afc submission|submit)", re.I)
+    TEMPLATE_NAME = re.compile(r"\{\{([^{}|]*)(?=[|}])")
+
+    # Used to find the template region (see region()); markers are braces,
+    # and also triple braces, comments, and tags whose contents
+    # mwparserfromhell doesn't parse, any of which make the region unusable:
+    BRACES = re.compile(r"\{\{|\}\}")
+    REGION_MARKER = re.compile(
+        r"\{\{\{|\}\}\}|\{\{|\}\}|<!--|-->|<\s*/?\s*(?:categorytree|ce|chem|"
+        r"gallery|graph|hiero|imagemap|inputbox|math|nowiki|pre|score|section|"
+        r"source|syntaxhighlight|templatedata|timeline)\b",
+        re.I,
+    )
+
+    # Template parameters kept in records (see record):
+    RECORD_PARAMS = ("u", "ts", "decliner", "declinets", "reject")
+
+    def __init__(self, content, stats=None):
+        self.content = content
+        self._stats = stats
+        self._parsed = False
+        self._statuses = []
+        self._submissions = []
+        self._rejected = False
+        self._searches = {}
+        self._region_hash = None
+        self._region_checked = False
+
+    def _parse(self):
+        """Parse the content and extract the {{AfC submission}} templates."""
+        if self._parsed:
+            return
+        if not self._has_candidates():
+            self._parsed = True
+            return
+        start = time()
+        statuses, submissions = [], []
+        code = mwparserfromhell.parse(self.content)
+        for template in code.filter_templates():
+            name = template.name.strip().lower()
+            if name == "afc submission":
+                if template.has(1, ignore_empty=True):
+                    status = template.get(1).value.strip().upper()
+                    valid = status in self.VALID_STATUSES
+                    statuses.append(status if valid else "P")
+                else:
+                    statuses.append("P")
+                params = {
+                    str(param.name).strip(): str(param.value)
+                    for param in template.params
+                }
+                status = params["1"].strip().upper() if "1" in params else "P"
+                submissions.append((status, params))
+            elif name in self.STATUS_ALIASES:
+                statuses.append(self.STATUS_ALIASES[name])
+
+        self._statuses = statuses
+        self._submissions = submissions
+        self._rejected = any(params.get("reject") for _, params in submissions)
+        self._parsed = True
+        if self._stats:
+            self._stats.add("parse", time() - start)
+
+    def _has_candidates(self):
+        """Return whether the content may contain a template we care about.
+
+        This is a cheap, conservative check: it can give false positives (like
+        templates inside comments), which the full parse then sorts out.
+        """
+        if not self.CANDIDATE_GATE.search(self.content):
+            return False
+        for match in self.TEMPLATE_NAME.finditer(self.content):
+            if match.group(1).strip().lower() in self.TEMPLATE_NAMES:
+                return True
+        return False
+
+    def _match_braces(self, start):
+        """Return the end of the template whose braces open at 'start'."""
+        depth = 0
+        for match in self.BRACES.finditer(self.content, start):
+            depth += 1 if match.group() == "{{" else -1
+            if depth == 0:
+                return match.end()
+        return len(self.content)
+
+    def region(self):
+        """Return the parts of the content that decide the parse results.
+
+        These are the full text of each candidate template, found by matching
+        braces, with a character of context on each side, and every brace
+        marker, in order. Markers after the last template are left out if
+        every brace opened before it is closed, since they can't affect any
+        template. If two revisions have the same region, they have the same
+        statuses, submissions, and rejected.
+
+        If a comment, an unparsed tag (like <nowiki>), or a triple brace is
+        among the markers, None is returned instead: these can hide or reshape
+        templates in ways too subtle to capture here (like "<!--->" closing a
+        comment), so such pages are always parsed.
+        """
+        templates = []
+        for match in self.TEMPLATE_NAME.finditer(self.content):
+            if match.group(1).strip().lower() in self.TEMPLATE_NAMES:
+                end = self._match_braces(match.start())
+                templates.append((max(match.start() - 1, 0), end + 1))
+        limit = max((end for (_, end) in templates), default=0)
+        markers = list(self.REGION_MARKER.finditer(self.content, 0, limit))
+        if not self._is_closed([match.group() for match in markers]):
+            markers = list(self.REGION_MARKER.finditer(self.content))
+        if any(match.group() not in ("{{", "}}") for match in markers):
+            return None
+        markers = [(match.start(), match.end()) for match in markers]
+        return [self.content[start:end] for start, end in sorted(templates + markers)]
+
+    @staticmethod
+    def _is_closed(markers):
+        """Return whether every {{ in a list of brace markers is closed."""
+        depth = 0
+        for marker in markers:
+            if marker == "{{":
+                depth += 1
+            elif marker == "}}":
+                depth = max(depth - 1, 0)
+        return not depth
+
+    @property
+    def region_hash(self):
+        """A SHA-256 digest of the content's template region (see region()).
+
+        This is None if the region can't be used, so nothing should be reused
+        or stored for the content.
+        """
+        if not self._region_checked:
+            region = self.region()
+            if region is not None:
+                digest = sha256()
+                for part in region:
+                    digest.update(part.encode("utf8") + b"\0")
+                self._region_hash = digest.digest()
+            self._region_checked = True
+        return self._region_hash
+
+    @property
+    def record(self):
+        """A compact JSON record of the parse results, for restore().
+
+        Only the template parameters in RECORD_PARAMS are kept.
+        """
+        self._parse()
+        submissions = [
+            (status, {k: v for k, v in params.items() if k in self.RECORD_PARAMS})
+            for status, params in self._submissions
+        ]
+        record = [self._statuses, submissions, self._rejected]
+        return json.dumps(record, separators=(",", ":"))
+
+    def restore(self, record):
+        """Use the parse results in a record instead of parsing the content."""
+        if self._parsed:
+            return
+        statuses, submissions, rejected = json.loads(record)
+        self._statuses = statuses
+        self._submissions = [(status, params) for status, params in submissions]
+        self._rejected = rejected
+        self._parsed = True
+
+    def _search(self, regex, flags=0):
+        """Return whether the content matches the given regex."""
+        key = (regex, flags)
+        if key not in self._searches:
+            self._searches[key] = bool(re.search(regex, self.content, flags))
+        return self._searches[key]
+
+    @property
+    def statuses(self):
+        """A list of all AfC submission statuses in the content."""
+        self._parse()
+        return self._statuses
+
+    @property
+    def submissions(self):
+        """A list of (status, params) for each {{AfC submission}} template.
+
+        The status is the raw, uppercased first parameter (or "P" if it is
+        missing), and params is a dict of parameter names to values.
+        """
+        self._parse()
+        return self._submissions
+
+    @property
+    def rejected(self):
+        """Whether any {{AfC submission}} template has a nonempty |reject=."""
+        self._parse()
+        return self._rejected
+
+    @property
+    def has_references(self):
+        """Whether the content contains any <ref> tags."""
+        return self._search(r"\<ref\s*(.*?)\>(.*?)\</ref\>", re.I | re.S)
+
+    def has_links(self, domain):
+        """Whether the content contains any links to sites besides 'domain'."""
+        regex = r"(https?:)|\[//(?!{0})([^ \]\t\n\r\f\v]+?)"
+        return self._search(regex.format(re.escape(domain)), re.I | re.S)
+
+    def has_template(self, name):
+        """Whether the content transcludes the given template."""
+        return self._search(r"\{\{s*" + name)
+
+
+class _ConnectionPool:
+    """A small pool of SQL connections, opened with 'connect'.
+
+    Connections are opened as needed and kept for reuse until the pool is
+    closed, though no more than 'size' idle connections are kept at once.
+    """
+
+    def __init__(self, connect, size):
+        self._connect = connect
+        self._size = size
+        self._idle = []
+        self._lock = Lock()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection from the pool for the duration of a block."""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect()
+        try:
+            yield conn
+        except Exception:
+            conn.close()
+            raise
+        with self._lock:
+            if len(self._idle) < self._size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Close all idle connections in the pool."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class _WriteBuffer:
+    """Collects changes to our database during a sync.
+
+    Changed columns are merged per page, and everything is written at once by
+    flush(), which groups pages with the same changed columns into batches.
+    Untracking a page discards any other changes waiting for it. Rows of the
+    tables that remember things about pages, like creation and submission,
+    are collected with remember() and replaced together.
+    """
+
+    def __init__(self):
+        self._inserts = OrderedDict()
+        self._updates = OrderedDict()
+        self._deletes = set()
+        self._memos = OrderedDict()
+        self._lock = Lock()
+
+    def __contains__(self, pageid):
+        with self._lock:
+            return (
+                pageid in self._inserts
+                or pageid in self._updates
+                or pageid in self._deletes
+            )
+
+    def insert(self, pageid, chart, page, update):
+        """Add a newly tracked page, given its full page and updatelog rows.
+
+        'update' is the updatelog row without the page ID.
+        """
+        with self._lock:
+            self._deletes.discard(pageid)
+            self._inserts[pageid] = (chart, page, update)
+
+    def update(self, pageid, **columns):
+        """Set the given columns of a tracked page."""
+        with self._lock:
+            if pageid not in self._deletes:
+                self._updates.setdefault(pageid, {}).update(columns)
+
+    def delete(self, pageid):
+        """Remove a page from our database."""
+        with self._lock:
+            self._inserts.pop(pageid, None)
+            self._updates.pop(pageid, None)
+            self._deletes.add(pageid)
+
+    def remember(self, table, row):
+        """Replace a full row of a table keyed by page ID, like creation."""
+        with self._lock:
+            self._memos.setdefault(table, OrderedDict())[row[0]] = row
+
+    def flush(self, cursor):
+        """Write all buffered changes and clear the buffer.
+
+        Returns the number of pages that were written.
+        """
+        query1 = """DELETE FROM page, row, updatelog USING page JOIN row
+                    ON page_id = row_id JOIN updatelog ON page_id = update_id
+                    WHERE page_id = ?"""
+        query2 = "INSERT INTO row VALUES (?, ?)"
+        query3 = "INSERT INTO page VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        query4 = "INSERT INTO updatelog VALUES (?, ?, ?)"
+        query5 = """UPDATE page JOIN row ON page_id = row_id
+                    JOIN updatelog ON page_id = update_id
+                    SET {0} WHERE page_id = ?"""
+        query6 = "REPLACE INTO {0} VALUES ({1})"
+
+        with self._lock:
+            inserts, self._inserts = self._inserts, OrderedDict()
+            updates, self._updates = self._updates, OrderedDict()
+            deletes, self._deletes = self._deletes, set()
+            memos, self._memos = self._memos, OrderedDict()
+
+        if deletes:
+            cursor.executemany(query1, [(pageid,) for pageid in deletes])
+        if inserts:
+            rows = inserts.items()
+            cursor.executemany(query2, [(pid, chart) for pid, (chart, _, _) in rows])
+            cursor.executemany(query3, [page for (_, page, _) in inserts.values()])
+            cursor.executemany(query4, [(pid,) + u for pid, (_, _, u) in rows])
+
+        batches = OrderedDict()
+        for pageid, columns in updates.items():
+            names = tuple(sorted(columns))
+            args = [columns[name] for name in names] + [pageid]
+            batches.setdefault(names, []).append(args)
+        for names, args in batches.items():
+            assignments = ", ".join(name + " = ?" for name in names)
+            cursor.executemany(query5.format(assignments), args)
+
+        for table, rows in memos.items():
+            rows = list(rows.values())
+            params = ", ".join("?" * len(rows[0]))
+            cursor.executemany(query6.format(table, params), rows)
+
+        return len(deletes) + len(inserts) + len(updates)
+
+
+class _SyncStats:
+    """Timings and counters for a single sync or save.
+
+    Phases of the action are timed with phase(). Replica queries, API calls,
+    and parses are counted and timed with add(), and cache lookups are counted
+    with hit(). This is safe to use from several threads at once.
+    """
+
+    def __init__(self, action):
+        self.action = action
+        self.started = datetime.utcnow()
+        self.elapsed = None
+        self.phases = OrderedDict()
+        self.timings = OrderedDict()
+        self.hits = OrderedDict()
+        self.pages = 0
+        self._start = time()
+        self._lock = Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Time a phase of the action for the duration of a block."""
+        start = time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0) + time() - start
+
+    def add(self, kind, seconds):
+        """Record one operation of the given kind, like "sql" or "api"."""
+        with self._lock:
+            count, total = self.timings.get(kind, (0, 0))
+            self.timings[kind] = (count + 1, total + seconds)
+
+    def hit(self, cache, hit):
+        """Record a lookup in the given cache, and whether it was a hit."""
+        with self._lock:
+            hits, lookups = self.hits.get(cache, (0, 0))
+            self.hits[cache] = (hits + bool(hit), lookups + 1)
+
+    def add_pages(self, count):
+        """Record that the given number of pages were processed."""
+        with self._lock:
+            self.pages += count
+
+    def finish(self):
+        """Mark the action as finished."""
+        self.elapsed = time() - self._start
+
+    def summary(self):
+        """Return a one-line summary of the stats."""
+        with self._lock:
+            phases = ", ".join(
+                f"{name} {secs:.1f}s" for name, secs in self.phases.items()
+            )
+            timings = "; ".join(
+                f"{kind} {count}x {secs:.2f}s"
+                for kind, (count, secs) in self.timings.items()
+            )
+            hits = ", ".join(
+                f"{cache} {hits}/{lookups}"
+                for cache, (hits, lookups) in self.hits.items()
+            )
+        elapsed = time() - self._start if self.elapsed is None else self.elapsed
+        parts = [f"{self.action} took {elapsed:.1f}s ({phases or 'no phases'})"]
+        parts.append(f"{self.pages} pages")
+        if timings:
+            parts.append(timings)
+        if hits:
+            parts.append(f"cache hits: {hits}")
+        return "; ".join(parts)
@@ -18,6 +18,7 @@ CREATE TABLE `chart` (
   `chart_name` varchar(255) COLLATE utf8_unicode_ci NOT NULL,
   `chart_title` varchar(255) COLLATE utf8_unicode_ci DEFAULT NULL,
   `chart_special_title` varchar(255) COLLATE utf8_unicode_ci DEFAULT NULL,
+  `chart_hash` binary(32) DEFAULT NULL,
   PRIMARY KEY (`chart_id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=7 DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 
@@ -27,11 +28,11 @@ CREATE TABLE `chart` (
 
 LOCK TABLES `chart` WRITE;
 INSERT INTO `chart` VALUES
-(1,'pending','Pending submissions','Submitted'),
-(3,'reviewing','Being reviewed','Reviewer'),
-(4,'accepted','Recently accepted','Accepted'),
-(5,'declined','Recently declined','Declined'),
-(6,'misplaced','Misplaced submissions','Created');
+(1,'pending','Pending submissions','Submitted',NULL),
+(3,'reviewing','Being reviewed','Reviewer',NULL),
+(4,'accepted','Recently accepted','Accepted',NULL),
+(5,'declined','Recently declined','Declined',NULL),
+(6,'misplaced','Misplaced submissions','Created',NULL);
 UNLOCK TABLES;
 
 --
@@ -42,7 +43,8 @@ DROP TABLE IF EXISTS `row`;
 CREATE TABLE `row` (
   `row_id` int(10) unsigned NOT NULL,
   `row_chart` tinyint(3) unsigned DEFAULT NULL,
-  PRIMARY KEY (`row_id`)
+  PRIMARY KEY (`row_id`),
+  KEY `row_chart` (`row_chart`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 
 --
@@ -62,7 +64,8 @@ CREATE TABLE `page` (
   `page_special_user` varchar(255) COLLATE utf8_unicode_ci DEFAULT NULL,
   `page_special_time` timestamp NOT NULL DEFAULT '0000-00-00 00:00:00',
   `page_special_oldid` int(10) unsigned DEFAULT NULL,
-  PRIMARY KEY (`page_id`)
+  PRIMARY KEY (`page_id`),
+  KEY `page_special_time` (`page_special_time`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 
 --
@@ -73,7 +76,76 @@ DROP TABLE IF EXISTS `updatelog`;
 CREATE TABLE `updatelog` (
   `update_id` int(10) unsigned NOT NULL,
   `update_time` timestamp NOT NULL DEFAULT '0000-00-00 00:00:00',
-  PRIMARY KEY (`update_id`)
+  `update_replag` int(10) unsigned NOT NULL DEFAULT '0',
+  PRIMARY KEY (`update_id`),
+  KEY `update_time` (`update_time`),
+  KEY `update_replag` (`update_replag`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 
+--
+-- Table structure for table `syncstate`
+--
+
+DROP TABLE IF EXISTS `syncstate`;
+CREATE TABLE `syncstate` (
+  `state_key` varchar(64) COLLATE utf8_unicode_ci NOT NULL,
+  `state_value` varchar(255) COLLATE utf8_unicode_ci DEFAULT NULL,
+  PRIMARY KEY (`state_key`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
+
+--
+-- Table structure for table `creation`
+--
+
+DROP TABLE IF EXISTS `creation`;
+CREATE TABLE `creation` (
+  `create_id` int(10) unsigned NOT NULL,
+  `create_user` varchar(255) COLLATE utf8_unicode_ci DEFAULT NULL,
+  `create_time` timestamp NOT NULL DEFAULT '0000-00-00 00:00:00',
+  `create_oldid` int(10) unsigned NOT NULL,
+  PRIMARY KEY (`create_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
+
+--
+-- Table structure for table `submission`
+--
+
+DROP TABLE IF EXISTS `submission`;
+CREATE TABLE `submission` (
+  `submission_id` int(10) unsigned NOT NULL,
+  `submission_hash` binary(32) NOT NULL,
+  `submission_record` mediumtext COLLATE utf8_unicode_ci NOT NULL,
+  `submission_chart` tinyint(3) unsigned NOT NULL,
+  `submission_special_user` varchar(255) COLLATE utf8_unicode_ci DEFAULT NULL,
+  `submission_special_time` timestamp NULL DEFAULT NULL,
+  `submission_special_oldid` int(10) unsigned DEFAULT NULL,
+  PRIMARY KEY (`submission_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
+
+--
+-- Table structure for table `migration`
+--
+
+DROP TABLE IF EXISTS `migration`;
+CREATE TABLE `migration` (
+  `migration_name` varchar(64) COLLATE utf8_unicode_ci NOT NULL,
+  `migration_time` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`migration_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
+
+--
+-- Dumping data for table `migration`
+--
+
+LOCK TABLES `migration` WRITE;
+INSERT INTO `migration` (`migration_name`) VALUES
+('chart_hash'),
+('syncstate'),
+('time_indexes'),
+('update_replag'),
+('creation'),
+('submission'),
+('replag_index');
+UNLOCK TABLES;
+
 -- Dump completed on 2014-01-10 11:00:00